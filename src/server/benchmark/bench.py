@@ -0,0 +1,212 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from generators import chain, layered_plant, mesh  # noqa: E402
+from reachability import ReachabilityIndex  # noqa: E402
+from routing import Graph, cost_matrix, k_shortest_path, multilple_dest_path  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def topologies(quick: bool) -> dict:
+    scale = [1, 4] if quick else [1, 4, 16]
+    result = {}
+    for factor in scale:
+        result[f"layered-w{10 * factor}"] = layered_plant(width=10 * factor, seed=factor)
+        side = 10 * int(factor ** 0.5) * 2
+        result[f"mesh-{side}x{side}"] = mesh(side, side, seed=factor)
+        result[f"chain-{50 * factor}"] = chain(50 * factor, seed=factor)
+    return result
+
+
+def measure(setup, fn, repeat: int) -> dict:
+    # Best wall time of `repeat` runs on fresh inputs, the search counters of
+    # one run and the peak traced allocation of another.
+    times = []
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - start)
+    args = setup()
+    stats = {}
+    tracemalloc.start()
+    fn(*args, stats)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"ms": min(times) * 1000, **stats, "peak_kb": peak / 1024}
+
+
+def build_case(topology):
+    def setup():
+        return topology.vertices, topology.edges
+
+    def run(vertices, edges, stats=None):
+        Graph(vertices, edges)
+
+    return setup, run
+
+
+def reachability_case(G):
+    def setup():
+        return ()
+
+    def run(stats=None):
+        ReachabilityIndex(G)
+
+    return setup, run
+
+
+def k_shortest_path_case(G, src, dst, K, search="auto"):
+    def setup():
+        # A copy starts without cached shortest path trees
+        return (G.copy(),)
+
+    def run(H, stats=None):
+        k_shortest_path(H, src, dst, K, stats=stats, search=search)
+
+    return setup, run
+
+
+def cost_matrix_case(G, sources, destinations):
+    def setup():
+        return (G.copy(),)
+
+    def run(H, stats=None):
+        matrix = cost_matrix(H, sources, destinations)
+        if stats is not None:
+            stats["expanded"] = matrix["expanded"]
+
+    return setup, run
+
+
+def multiple_dest_case(G, src, dst, K):
+    result = k_shortest_path(G.copy(), src, dst, K)
+
+    def setup():
+        return ()
+
+    def run(stats=None):
+        multilple_dest_path(G, result, K, stats)
+
+    return setup, run
+
+
+def cases(quick: bool):
+    graphs = {
+        name: (topology, Graph(topology.vertices, topology.edges))
+        for name, topology in topologies(quick).items()
+    }
+    for name, (topology, _) in graphs.items():
+        yield f"build/{name}", build_case(topology)
+    for name, (topology, G) in graphs.items():
+        for K in [1, 5, 20]:
+            yield f"ksp/{name}/K{K}", k_shortest_path_case(
+                G, topology.sources[0], topology.destinations[-1], K
+            )
+        for search in ["forward", "bidirectional"]:
+            yield f"ksp-{search}/{name}/K5", k_shortest_path_case(
+                G, topology.sources[0], topology.destinations[-1], 5, search
+            )
+        # Same query with the reachability index, and one between two
+        # sources, unreachable unless the plant has cycles through them
+        R = G.copy()
+        R.reachability = ReachabilityIndex(R)
+        yield f"reach-build/{name}", reachability_case(G)
+        yield f"ksp-reach/{name}/K5", k_shortest_path_case(
+            R, topology.sources[0], topology.destinations[-1], 5
+        )
+        yield f"matrix/{name}", cost_matrix_case(G, topology.sources, topology.destinations)
+        if len(topology.sources) > 1:
+            for label, H in [("ksp-sources", G), ("ksp-sources-reach", R)]:
+                yield f"{label}/{name}/K5", k_shortest_path_case(
+                    H, topology.sources[0], topology.sources[-1], 5
+                )
+    topology = layered_plant(width=20 if quick else 40, destinations=12, seed=7)
+    G = Graph(topology.vertices, topology.edges)
+    for n in [1, 2, 4, 8, 12]:
+        yield f"multi/layered/dst{n}", multiple_dest_case(
+            G, topology.sources[0], topology.destinations[:n], 5
+        )
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_ms: float) -> int:
+    regressions = 0
+    print(f"{'case':<36}{'ms':>10}{'base ms':>10}{'ratio':>8}"
+          f"{'expanded':>10}{'peak kb':>10}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        line = f"{name:<36}{result['ms']:>10.2f}"
+        notes = []
+        if base is None:
+            line += f"{'-':>10}{'-':>8}"
+            notes.append("new")
+        else:
+            ratio = result["ms"] / base["ms"] if base["ms"] else 1.0
+            line += f"{base['ms']:>10.2f}{ratio:>8.2f}"
+            if ratio > 1 + tolerance and result["ms"] - base["ms"] > min_ms:
+                notes.append("SLOWER")
+                regressions += 1
+            for key in ("expanded", "combinations"):
+                if key in result and result[key] > base.get(key, result[key]):
+                    notes.append(f"MORE {key.upper()} ({base[key]})")
+                    regressions += 1
+        work = result.get("expanded", result.get("combinations", "-"))
+        line += f"{work:>10}{result['peak_kb']:>10.0f}"
+        print(line, " ".join(notes))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the routing algorithms on synthetic plant topologies"
+    )
+    parser.add_argument("--baseline", default=BASELINE,
+                        help="Baseline results to compare against")
+    parser.add_argument("--save", action="store_true",
+                        help="Store this run as the new baseline")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Timed runs per case, the best one is kept")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed slowdown against the baseline")
+    parser.add_argument("--min-ms", type=float, default=1.0,
+                        help="Slowdowns below this many milliseconds are noise")
+    parser.add_argument("--quick", action="store_true",
+                        help="Only run the smaller graphs")
+    parser.add_argument("--filter", default="",
+                        help="Only run cases whose name contains this")
+    args = parser.parse_args()
+
+    results = {}
+    for name, (setup, run) in cases(args.quick):
+        if args.filter in name:
+            results[name] = measure(setup, run, args.repeat)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["cases"]
+    regressions = compare(results, baseline, args.tolerance, args.min_ms)
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cases": {**baseline, **results}
+            }, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif regressions:
+        print(f"{regressions} regression(s) against {args.baseline}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import random
+from typing import List, NamedTuple, Tuple
+
+
+# Seeded synthetic topologies shaped like our plants, in the (vertices, edges)
+# form routing.Graph is built from. Connections are unidirectional: no
+# generator emits both (a, b) and (b, a).
+
+class Topology(NamedTuple):
+    vertices: List[Tuple[str, int]]
+    edges: List[Tuple[str, str, int]]
+    sources: List[str]
+    destinations: List[str]
+
+
+def layered_plant(
+        sources: int = 4,
+        layers: int = 6,
+        width: int = 20,
+        destinations: int = 8,
+        fanout: int = 3,
+        seed: int = 0,
+        max_device_cost: int = 5,
+        max_connection_cost: int = 10
+) -> Topology:
+    # source -> processing layers -> destination DAG. Every device feeds
+    # `fanout` devices of the next layer and now and then skips one.
+    rng = random.Random(seed)
+    tiers = [[f"S{i}" for i in range(sources)]]
+    tiers += [[f"L{layer}_{i}" for i in range(width)] for layer in range(layers)]
+    tiers.append([f"D{i}" for i in range(destinations)])
+    vertices = [
+        (name, rng.randint(0, max_device_cost)) for tier in tiers for name in tier
+    ]
+    edges = set()
+    for t in range(len(tiers) - 1):
+        for name in tiers[t]:
+            for dst in rng.sample(tiers[t + 1], min(fanout, len(tiers[t + 1]))):
+                edges.add((name, dst))
+            if t + 2 < len(tiers) and rng.random() < 0.2:
+                edges.add((name, rng.choice(tiers[t + 2])))
+    edges = [
+        (src, dst, rng.randint(1, max_connection_cost)) for src, dst in sorted(edges)
+    ]
+    return Topology(vertices, edges, tiers[0], tiers[-1])
+
+
+def mesh(
+        rows: int = 20,
+        cols: int = 20,
+        seed: int = 0,
+        max_device_cost: int = 5,
+        max_connection_cost: int = 10
+) -> Topology:
+    # Torus with alternating one way rows and columns (a Manhattan street
+    # network), strongly connected and full of cycles for even sizes above
+    # two. Sources sit in the first column, destinations in the last one.
+    rng = random.Random(seed)
+
+    def name(r, c):
+        return f"M{r}_{c}"
+
+    vertices = [
+        (name(r, c), rng.randint(0, max_device_cost))
+        for r in range(rows) for c in range(cols)
+    ]
+    edges = []
+    for r in range(rows):
+        for c in range(cols):
+            step = 1 if r % 2 == 0 else -1
+            edges.append((name(r, c), name(r, (c + step) % cols)))
+            step = 1 if c % 2 == 0 else -1
+            edges.append((name(r, c), name((r + step) % rows, c)))
+    edges = [(src, dst, rng.randint(1, max_connection_cost)) for src, dst in edges]
+    return Topology(
+        vertices,
+        edges,
+        [name(r, 0) for r in range(rows)],
+        [name(r, cols - 1) for r in range(rows)]
+    )
+
+
+def chain(
+        length: int = 200,
+        bypass_every: int = 5,
+        seed: int = 0,
+        max_device_cost: int = 5,
+        max_connection_cost: int = 10
+) -> Topology:
+    # Long conveyor like chain, every `bypass_every` devices a bypass skips
+    # one device so there are alternatives for the K shortest paths.
+    rng = random.Random(seed)
+    names = [f"C{i}" for i in range(length)]
+    vertices = [(name, rng.randint(0, max_device_cost)) for name in names]
+    edges = [(names[i], names[i + 1]) for i in range(length - 1)]
+    edges += [
+        (names[i], names[i + 2]) for i in range(0, length - 2, bypass_every)
+    ]
+    edges = [(src, dst, rng.randint(1, max_connection_cost)) for src, dst in edges]
+    return Topology(vertices, edges, names[:1], names[-1:])
@@ -0,0 +1,394 @@
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server")
+sys.path.insert(0, SERVER)
+
+from sqlalchemy import create_engine, insert, select  # noqa: E402
+
+from generators import chain, layered_plant, mesh  # noqa: E402
+from schema import Base, Connections, Devices  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "load_baseline.json")
+MIX = "best_paths=50,combined_paths=10,list_devices=15,list_connections=10," \
+      "update_device=10,update_connection=5"
+
+
+# End to end load test: seeds a SQLite stand-in for the plant database, runs
+# the API from main.py on it under uvicorn and drives a weighted mix of path
+# queries and CRUD calls from concurrent clients, then reports throughput
+# and latency percentiles per endpoint.
+
+class Plant:
+
+    def __init__(self, devices: dict, connections: dict) -> None:
+        # devices: name -> (isSource, isDest, cost), connections: (src, dst) -> cost
+        self.devices = devices
+        self.connections = connections
+        self.sources = sorted(name for name, (source, _, _) in devices.items() if source)
+        self.destinations = sorted(name for name, (_, dest, _) in devices.items() if dest)
+        self.others = sorted(
+            name for name, (source, dest, _) in devices.items() if not source and not dest
+        )
+        self.edges = sorted(connections)
+
+
+def topology_plant(name: str, size: int) -> Plant:
+    if name == "layered":
+        topology = layered_plant(width=10 * size, seed=size)
+    elif name == "mesh":
+        topology = mesh(10 * size, 10 * size, seed=size)
+    else:
+        topology = chain(50 * size, seed=size)
+    sources, destinations = set(topology.sources), set(topology.destinations)
+    devices = {
+        name: (name in sources, name in destinations, cost)
+        for name, cost in topology.vertices
+    }
+    return Plant(devices, {(src, dst): cost for src, dst, cost in topology.edges})
+
+
+def seed_database(url: str, plant: Plant | None, csv: str | None) -> None:
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    if csv is not None:
+        import driver
+        driver.chunked_bulk_insert(csv, engine, 10000, 1000)
+    else:
+        with engine.begin() as conn:
+            conn.execute(insert(Devices), [
+                {"name": name, "isSource": source, "isDest": dest, "cost": cost}
+                for name, (source, dest, cost) in plant.devices.items()
+            ])
+            conn.execute(insert(Connections), [
+                {"src": src, "dst": dst, "cost": cost}
+                for (src, dst), cost in plant.connections.items()
+            ])
+    engine.dispose()
+
+
+def read_plant(url: str) -> Plant:
+    # What the server will load, the csv leaves costs to the defaults
+    engine = create_engine(url)
+    with engine.connect() as conn:
+        devices = {
+            row.name: (row.isSource, row.isDest, row.cost)
+            for row in conn.execute(select(Devices))
+        }
+        connections = {
+            (row.src, row.dst): row.cost for row in conn.execute(select(Connections))
+        }
+    engine.dispose()
+    return Plant(devices, connections)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(url: str, port: int, workers: int, log: str, timeout: float = 60):
+    env = {**os.environ, "DB_URL": url}
+    with open(log, "w") as f:
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+             "--workers", str(workers), "--no-access-log"],
+            cwd=SERVER, env=env, stdout=f, stderr=subprocess.STDOUT
+        )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            with open(log) as f:
+                raise RuntimeError(f"Server exited during startup:\n{f.read()[-2000:]}")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/graph/status", timeout=1)
+            return process
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Server did not answer within {timeout}s, see {log}")
+
+
+def request(base: str, method: str, path: str, params: dict | None = None,
+            body: dict | None = None) -> int:
+    url = base + path
+    if params:
+        url += "?" + urllib.parse.urlencode(params)
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(
+        url, data=data, method=method, headers={"Content-Type": "application/json"}
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=60) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def operations(plant: Plant, K: int):
+    # Each operation picks its arguments and returns (method, path, params,
+    # body)
+    def destinations(rng, n):
+        # The dst parameter is limited to 30 characters with the commas
+        dst = rng.sample(plant.destinations, min(len(plant.destinations), n))
+        while len(dst) > 1 and len(",".join(dst)) > 30:
+            dst.pop()
+        return ",".join(dst)
+
+    def best_paths(rng):
+        return "GET", "/best/paths/", {
+            "src": rng.choice(plant.sources), "dst": destinations(rng, rng.randint(1, 3)),
+            "num_best_path": K
+        }, None
+
+    def combined_paths(rng):
+        return "GET", "/combined/paths", {
+            "src": rng.choice(plant.sources), "dst": destinations(rng, 2), "num_best_path": K
+        }, None
+
+    def list_devices(rng):
+        return "GET", "/devices/", {"limit": 100}, None
+
+    def list_connections(rng):
+        return "GET", "/connections/", {"limit": 100}, None
+
+    def update_device(rng):
+        name = rng.choice(plant.others or plant.sources)
+        source, dest, cost = plant.devices[name]
+        return "PUT", "/update/devices/", None, {
+            "name": name, "isSource": source, "isDest": dest, "status": 0,
+            "cost": max(0, (cost or 0) + rng.choice([-1, 1]))
+        }
+
+    def update_connection(rng):
+        src, dst = rng.choice(plant.edges)
+        return "POST", "/add/connections/", None, {
+            "src": src, "dst": dst,
+            "cost": max(1, (plant.connections[src, dst] or 1) + rng.choice([-1, 1]))
+        }
+
+    return {
+        "best_paths": best_paths,
+        "combined_paths": combined_paths,
+        "list_devices": list_devices,
+        "list_connections": list_connections,
+        "update_device": update_device,
+        "update_connection": update_connection,
+    }
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def drive(base: str, plant: Plant, mix: dict, K: int, concurrency: int,
+          duration: float, seed: int) -> tuple[dict, float]:
+    ops = operations(plant, K)
+    unknown = mix.keys() - ops.keys()
+    if unknown:
+        raise ValueError(f"Unknown operations {', '.join(sorted(unknown))}, "
+                         f"choose from {', '.join(ops)}")
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = defaultdict(list)
+    errors = defaultdict(lambda: defaultdict(int))
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(i):
+        rng = random.Random(seed * 1000 + i)
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            method, path, params, body = ops[name](rng)
+            start = time.perf_counter()
+            try:
+                status = request(base, method, path, params, body)
+            except (urllib.error.URLError, ConnectionError, TimeoutError) as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - start
+            with lock:
+                samples[name].append(elapsed)
+                if not isinstance(status, int) or status >= 400:
+                    errors[name][str(status)] += 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        name: {"latencies": samples[name], "errors": dict(errors[name])} for name in samples
+    }, elapsed
+
+
+def percentile(values: list[float], p: float) -> float:
+    # Nearest rank on sorted values
+    return values[max(0, -(-len(values) * p // 100) - 1)]
+
+
+def summarize(samples: dict, elapsed: float) -> dict:
+    results = {}
+    everything = []
+    statuses = defaultdict(int)
+    for name, sample in sorted(samples.items()):
+        latencies = sorted(sample["latencies"])
+        everything += latencies
+        for status, n in sample["errors"].items():
+            statuses[status] += n
+        results[name] = {
+            "requests": len(latencies),
+            "errors": sum(sample["errors"].values()),
+            "statuses": sample["errors"],
+            "rps": len(latencies) / elapsed,
+            **{f"p{p}_ms": percentile(latencies, p) * 1000 for p in (50, 95, 99)},
+        }
+    everything.sort()
+    if everything:
+        results["total"] = {
+            "requests": len(everything),
+            "errors": sum(statuses.values()),
+            "statuses": dict(statuses),
+            "rps": len(everything) / elapsed,
+            **{f"p{p}_ms": percentile(everything, p) * 1000 for p in (50, 95, 99)},
+        }
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_ms: float) -> int:
+    regressions = 0
+    print(f"{'endpoint':<20}{'requests':>10}{'errors':>8}{'req/s':>9}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'base p95':>10}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        line = (f"{name:<20}{result['requests']:>10}{result['errors']:>8}"
+                f"{result['rps']:>9.1f}{result['p50_ms']:>9.1f}"
+                f"{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}")
+        notes = []
+        if base is None:
+            line += f"{'-':>10}"
+        else:
+            line += f"{base['p95_ms']:>10.1f}"
+            if (result["p95_ms"] > base["p95_ms"] * (1 + tolerance)
+                    and result["p95_ms"] - base["p95_ms"] > min_ms):
+                notes.append("SLOWER")
+                regressions += 1
+        if result["errors"]:
+            notes.append("ERRORS " + " ".join(
+                f"{status}x{n}" for status, n in sorted(result.get("statuses", {}).items())
+            ))
+            regressions += 1
+        print(line, " ".join(notes))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test the API on a local SQLite stand-in for the plant database"
+    )
+    parser.add_argument("--topology", default="layered", choices=["layered", "mesh", "chain"],
+                        help="Synthetic plant to seed the database with")
+    parser.add_argument("--size", type=int, default=2,
+                        help="Scale factor of the synthetic plant")
+    parser.add_argument("--csv", default=None,
+                        help="Seed from a driver.py csv export instead")
+    parser.add_argument("--db", default=None,
+                        help="SQLite file to create, a temporary one by default")
+    parser.add_argument("--url", default=None,
+                        help="Load an already running server instead of starting one, "
+                             "it has to serve the plant in --db")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="uvicorn worker processes")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=20,
+                        help="Seconds of traffic")
+    parser.add_argument("--mix", default=MIX,
+                        help="Weighted operations, name=weight separated by commas")
+    parser.add_argument("--num-best-path", type=int, default=5,
+                        help="K of the path queries")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the generated traffic")
+    parser.add_argument("--baseline", default=BASELINE,
+                        help="Baseline results to compare against")
+    parser.add_argument("--save", action="store_true",
+                        help="Store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed p95 slowdown against the baseline")
+    parser.add_argument("--min-ms", type=float, default=5.0,
+                        help="p95 slowdowns below this many milliseconds are noise")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="sep-load-")
+    db = args.db or os.path.join(workdir, "plant.db")
+    url = f"sqlite:///{os.path.abspath(db)}"
+    server = None
+    if args.url is None:
+        if os.path.exists(db):
+            os.remove(db)
+        seed_database(url, None if args.csv else topology_plant(args.topology, args.size), args.csv)
+        plant = read_plant(url)
+        port = free_port()
+        log = os.path.join(workdir, "server.log")
+        server = start_server(url, port, args.workers, log)
+        base = f"http://127.0.0.1:{port}"
+        print(f"Serving {len(plant.devices)} devices and {len(plant.connections)} "
+              f"connections from {db}, server log in {log}")
+    else:
+        if args.db is None:
+            parser.error("--url needs the --db the server runs on")
+        plant = read_plant(url)
+        base = args.url.rstrip("/")
+    try:
+        samples, elapsed = drive(
+            base, plant, parse_mix(args.mix), args.num_best_path, args.concurrency,
+            args.duration, args.seed
+        )
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+    results = summarize(samples, elapsed)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["endpoints"]
+    regressions = compare(results, baseline, args.tolerance, args.min_ms)
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "topology": args.csv or f"{args.topology}/{args.size}",
+                "concurrency": args.concurrency,
+                "workers": args.workers,
+                "mix": args.mix,
+                "endpoints": results
+            }, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif regressions:
+        print(f"{regressions} regression(s) against {args.baseline}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
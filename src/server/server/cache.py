@@ -0,0 +1,125 @@
+import threading
+import time
+from typing import Callable
+
+from routing import Graph
+from snapshot import GraphSnapshot
+
+
+# Graph snapshot tagged with the graph version kept in the database. Every
+# write to devices or connections bumps that version in its own transaction,
+# so `snapshot` compares it with the cached one and reloads once any process
+# changed the graph. A graph is tagged with the version read before loading
+# it, it is never older than its version. With a positive `ttl` the snapshot
+# is also reloaded periodically to pick up out-of-band edits, and the
+# version is only bumped if the topology actually changed.
+#
+# With a shared snapshot file the graph comes from the file instead: every
+# process maps it, and whichever process finds it behind the database
+# version reloads the graph and publishes it for all of them.
+class GraphCache:
+
+    def __init__(
+            self,
+            loader: Callable[[], Graph],
+            current_version: Callable[[], int],
+            bump_version: Callable[[], None],
+            ttl: float = 0,
+            shared: GraphSnapshot | None = None
+    ) -> None:
+        self._loader = loader
+        self._current_version = current_version
+        self._bump_version = bump_version
+        self._ttl = ttl
+        self._shared = shared
+        self._lock = threading.Lock()
+        self._graph = None
+        self._loaded_at = 0.0
+        self.version = -1
+        self.hits = 0
+        self.misses = 0
+        self.deltas = 0
+
+    def _expired(self) -> bool:
+        return self._ttl > 0 and time.monotonic() - self._loaded_at > self._ttl
+
+    def get(self) -> Graph:
+        return self.snapshot()[0]
+
+    def snapshot(self) -> tuple[Graph, int]:
+        version = self._current_version()
+        with self._lock:
+            if self._graph is not None and self.version >= version and not self._expired():
+                self.hits += 1
+                return self._graph, self.version
+            self.misses += 1
+            if self._graph is not None and self._expired():
+                graph = self._loader()
+                if self.version >= version and graph.topology() != self._graph.topology():
+                    # Changed without a version bump. The bump makes every
+                    # process reload, this one included on its next call.
+                    self._bump_version()
+                version = max(version, self.version)
+            elif self._shared is not None:
+                graph, version = self._load_shared(version)
+            else:
+                graph = self._loader()
+            self._graph, self.version = graph, version
+            self._loaded_at = time.monotonic()
+            return graph, version
+
+    def _load_shared(self, version: int) -> tuple[Graph, int]:
+        shared = self._shared
+        if _version(shared) >= version:
+            return shared.read()
+        with shared.exclusive():
+            # Another process may have published it while this one waited
+            if _version(shared) >= version:
+                return shared.read()
+            graph = self._loader()
+            shared.publish(graph, version)
+            return graph, version
+
+    def peek(self, version: int) -> Graph | None:
+        # The cached graph if it is the one of `version`. Writers call it
+        # while they hold the database version, so no later version exists.
+        with self._lock:
+            if self._graph is not None and self.version == version:
+                return self._graph
+            if self._shared is not None and self._shared.version() == version:
+                self._graph, self.version = self._shared.read()
+                self._loaded_at = time.monotonic()
+                return self._graph
+        return None
+
+    def advance(self, old_version: int, new_version: int, graph: Graph | None) -> None:
+        # Apply a committed change to the cached snapshot as a delta instead
+        # of reloading it: graph is the snapshot of old_version with the
+        # change applied. None leaves the reload to the next `snapshot`.
+        with self._lock:
+            if graph is None or self.version != old_version:
+                return
+            self.deltas += 1
+            self._graph, self.version = graph, new_version
+            self._loaded_at = time.monotonic()
+            if self._shared is not None:
+                with self._shared.exclusive():
+                    if _version(self._shared) < new_version:
+                        self._shared.publish(graph, new_version)
+
+    def status(self) -> dict:
+        return {
+            "version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "deltas": self.deltas,
+            "cached": self._graph is not None,
+            "ttl": self._ttl,
+            "shared": self._shared.path if self._shared is not None else None,
+            "memory": self._graph.memory_usage() if self._graph is not None else None,
+        }
+
+
+def _version(shared: GraphSnapshot) -> int:
+    version = shared.version()
+    return -1 if version is None else version
@@ -0,0 +1,33 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable
+
+import metrics
+
+
+# Single flight execution of identical queries: the first request for a key
+# runs the computation, requests arriving while it is in flight await the
+# same result instead of repeating it. Keys must include the graph version
+# so a query is never answered from an older graph.
+class SingleFlight:
+
+    def __init__(self, endpoint: str) -> None:
+        self.endpoint = endpoint
+        self._in_flight = {}
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable]):
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            metrics.COALESCED_REQUESTS.inc(endpoint=self.endpoint)
+        # A request going away does not cancel the computation the others
+        # are waiting for
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Future) -> None:
+        del self._in_flight[key]
+        if not task.cancelled():
+            # Retrieved here too in case every waiter went away
+            task.exception()
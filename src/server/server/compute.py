@@ -0,0 +1,98 @@
+import asyncio
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from routing import Graph
+from settings import ROUTING_TIMEOUT, ROUTING_WORKERS
+
+_executor = None
+# Pickling of the graph of the latest version, only sent to workers whose
+# copy is out of date
+_payload = (None, None)
+# Unpickled graph held by each worker process
+_worker_graph = (None, None)
+
+
+class _StaleGraph(Exception):
+    pass
+
+
+def _call_with_graph(version: int, payload: bytes | None, fn: Callable, args: tuple):
+    global _worker_graph
+    if _worker_graph[0] != version:
+        if payload is None:
+            raise _StaleGraph(version)
+        _worker_graph = (version, pickle.loads(payload))
+    return fn(_worker_graph[1], *args)
+
+
+async def run_routing(G: Graph, version: int, fn: Callable, *args):
+    # Run fn(G, *args) off the event loop with the configured timeout. In
+    # process pool mode calls only carry the graph version. A worker whose
+    # graph is older asks for it, the graph is then pickled once per version
+    # and sent along with the call again.
+    global _executor, _payload
+    if ROUTING_WORKERS <= 0:
+        return await _wait(run_in_threadpool(fn, G, *args))
+    payload = None
+    while True:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(ROUTING_WORKERS)
+        executor = _executor
+        call = asyncio.get_running_loop().run_in_executor(
+            executor, _call_with_graph, version, payload, fn, args
+        )
+        try:
+            return await _wait(call)
+        except _StaleGraph:
+            # Calls of the same version share one pickling
+            if _payload[0] != version:
+                _payload = (
+                    version,
+                    asyncio.ensure_future(run_in_threadpool(pickle.dumps, G))
+                )
+            payload = await _payload[1]
+        except BrokenProcessPool:
+            # Only retried when another call timed out and recycled the pool
+            if executor is _executor:
+                raise
+        except HTTPException:
+            _recycle(executor)
+            raise
+
+
+async def _wait(call):
+    try:
+        return await asyncio.wait_for(call, ROUTING_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=504,
+            detail=f"Route computation exceeded {ROUTING_TIMEOUT}s"
+        )
+
+
+def _recycle(executor: ProcessPoolExecutor) -> None:
+    # A call that is already running cannot be cancelled, it would hold its
+    # worker until it finishes. The pool is replaced and its processes are
+    # ended, the calls they were running fail and are resubmitted.
+    global _executor
+    if _executor is not executor:
+        # Already recycled by another call that timed out
+        return
+    _executor = None
+    # No public way to reach the worker processes
+    for process in list(executor._processes.values()):
+        process.terminate()
+    executor.shutdown(wait=False)
+
+
+def shutdown() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
@@ -1,11 +1,13 @@
 import argparse
 import os
+import time
 
 import pandas as pd
 from sqlalchemy import URL
-from sqlalchemy import create_engine
+from sqlalchemy import bindparam, create_engine, delete, insert, select, update
 from sqlalchemy.orm import sessionmaker
 
+import path_store
 from schema import Base, Connections, Devices
 
 # Load environment variables
@@ -16,6 +18,15 @@ DB_PASSWD = os.getenv("DB_PASSWD", "Password@123456")
 DB_PORT = os.getenv("DB_PORT", 1433)
 DB_NAME = os.getenv("DB_NAME", "TestDB")
 
+# Optional csv columns, devices keep their current value when one is absent
+DEVICE_COLUMNS = {
+    "Plant Item": "name",
+    "Is Source": "isSource",
+    "Is Destination": "isDest",
+    "Status": "status",
+    "Cost": "cost",
+}
+
 
 def process_csv(df: pd.DataFrame):
     devices = set()
@@ -40,24 +51,202 @@ def process_csv(df: pd.DataFrame):
 
 def bulk_insert(devices, connections, Session):
     with Session() as session:
+        # Bumped like the API writes, so running servers reload the graph
+        path_store.bump_version(session)
+        path_store.clear(session)
         session.add_all(devices)
         session.add_all(connections)
         session.commit()
 
 
+def process_chunk(df: pd.DataFrame):
+    # Vectorised equivalent of process_csv returning plain DataFrames
+    df = df.dropna(subset=["Plant Item"])
+    columns = [column for column in DEVICE_COLUMNS if column in df.columns]
+    devices = df[columns].rename(columns=DEVICE_COLUMNS).drop_duplicates("name")
+    devices = devices.fillna({"status": 0, "cost": 1}).astype({
+        "isSource": bool, "isDest": bool, **{
+            field: int for field in ("status", "cost") if field in devices.columns
+        }
+    })
+    from_edges = df[["Connect from", "Plant Item"]].dropna().set_axis(["src", "dst"], axis=1)
+    to_edges = df[["Plant Item", "Connect to"]].dropna().set_axis(["src", "dst"], axis=1)
+    connections = pd.concat([from_edges, to_edges]).drop_duplicates()
+    return devices, connections
+
+
+def write_batches(engine, table, df: pd.DataFrame, batch_size: int):
+    # Core level executemany, one bounded transaction per batch
+    written = 0
+    for start in range(0, len(df), batch_size):
+        batch = df.iloc[start:start + batch_size].to_dict("records")
+        with engine.begin() as conn:
+            path_store.bump_version(conn)
+            path_store.clear(conn)
+            conn.execute(insert(table), batch)
+        written += len(batch)
+    return written
+
+
+def chunked_bulk_insert(path: str, engine, chunksize: int, batch_size: int):
+    start = time.perf_counter()
+    seen_devices = set()
+    connections = []
+    rows = 0
+    num_devices = 0
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        rows += len(chunk)
+        devices, chunk_connections = process_chunk(chunk)
+        devices = devices[~devices["name"].isin(seen_devices)]
+        seen_devices.update(devices["name"])
+        num_devices += write_batches(engine, Devices.__table__, devices, batch_size)
+        # Connections reference devices that may appear in later chunks,
+        # so they are written once every device is in place
+        connections.append(chunk_connections)
+        elapsed = time.perf_counter() - start
+        print(f"Read {rows} rows, inserted {num_devices} devices "
+              f"({rows / elapsed:.0f} rows/sec)")
+
+    connections = pd.concat(connections).drop_duplicates() if connections else pd.DataFrame()
+    num_connections = write_batches(engine, Connections.__table__, connections, batch_size)
+    elapsed = time.perf_counter() - start
+    print(f"Inserted {num_devices} devices and {num_connections} connections "
+          f"from {rows} rows in {elapsed:.2f}s ({rows / elapsed:.0f} rows/sec)")
+
+
+def read_plant(path: str, chunksize: int):
+    # Device rows keyed by name and the set of (src, dst) connections
+    devices = {}
+    connections = set()
+    fields = None
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        chunk_devices, chunk_connections = process_chunk(chunk)
+        fields = list(chunk_devices.columns[1:])
+        for row in chunk_devices.to_dict("split")["data"]:
+            devices.setdefault(row[0], tuple(row[1:]))
+        connections.update(map(tuple, chunk_connections.to_dict("split")["data"]))
+    return devices, connections, fields or ["isSource", "isDest"]
+
+
+def sync(path: str, engine, chunksize: int, batch_size: int, dry_run: bool = False):
+    # Bring the database in line with the csv by applying only the
+    # difference: rows are compared as hashed tuples, then inserts, updates
+    # and deletes are written in transactions of at most batch_size rows.
+    # Stored paths are invalidated the way the API does for the same writes.
+    start = time.perf_counter()
+    devices, connections, fields = read_plant(path, chunksize)
+    Session = sessionmaker(engine)
+    with Session() as session:
+        columns = [getattr(Devices, field) for field in fields]
+        current_devices = {
+            row[0]: tuple(row[1:])
+            for row in session.execute(select(Devices.name, *columns, Devices.status, Devices.cost))
+        }
+        current_connections = {
+            (row.src, row.dst): row.id
+            for row in session.execute(select(Connections.id, Connections.src, Connections.dst))
+        }
+    read_time = time.perf_counter() - start
+    # Checked up front, the delta is applied in several transactions
+    unknown = {name for connection in connections for name in connection} - devices.keys()
+    if unknown:
+        raise ValueError(f"Connections to devices missing from {path}: {', '.join(sorted(unknown))}")
+
+    wanted = {(name, *values) for name, values in devices.items()}
+    existing = {(name, *values[:len(fields)]) for name, values in current_devices.items()}
+    different = sorted(wanted - existing)
+    added_devices = [
+        dict(zip(["name", *fields], row)) for row in different
+        if row[0] not in current_devices
+    ]
+    changed_devices = [
+        dict(zip(["b_name", *fields], row)) for row in different
+        if row[0] in current_devices
+    ]
+    removed_devices = sorted(current_devices.keys() - devices.keys())
+    added_connections = [
+        {"src": src, "dst": dst} for src, dst in sorted(connections - current_connections.keys())
+    ]
+    removed_connections = sorted(
+        current_connections[key] for key in current_connections.keys() - connections
+    )
+    print(f"Compared {len(devices)} devices and {len(connections)} connections in "
+          f"{read_time:.2f}s: devices +{len(added_devices)} ~{len(changed_devices)} "
+          f"-{len(removed_devices)}, connections +{len(added_connections)} "
+          f"-{len(removed_connections)}")
+    if dry_run:
+        return
+
+    # Same rule as the update endpoints: a device that goes out of service or
+    # gets more expensive only invalidates the paths through it, anything that
+    # can make a path cheaper drops every stored path
+    worsened = set()
+    keep_stored_paths = not added_connections
+    for item in changed_devices:
+        status, cost = current_devices[item["b_name"]][-2:]
+        new_status, new_cost = item.get("status", status), item.get("cost", cost)
+        if new_status == status and new_cost == cost:
+            continue
+        if new_status != 0 or (status == 0 and (new_cost or 0) >= (cost or 0)):
+            worsened.add(item["b_name"])
+        else:
+            keep_stored_paths = False
+
+    def batches(items):
+        # Every transaction bumps the graph version like the API writes do
+        for i in range(0, len(items), batch_size):
+            with Session() as session:
+                versions = path_store.bump_version(session)
+                yield session, items[i:i + batch_size]
+                if keep_stored_paths:
+                    path_store.restamp(session, *versions)
+                else:
+                    path_store.clear(session)
+                session.commit()
+
+    for session, batch in batches(added_devices):
+        session.execute(insert(Devices), batch)
+    for session, batch in batches(changed_devices):
+        path_store.invalidate_devices(
+            session, [item["b_name"] for item in batch if item["b_name"] in worsened]
+        )
+        session.execute(
+            update(Devices.__table__)
+            .where(Devices.__table__.c.name == bindparam("b_name"))
+            .values({field: bindparam(field) for field in fields}),
+            batch
+        )
+    for session, batch in batches(removed_connections):
+        path_store.invalidate_connections(session, batch)
+        session.execute(delete(Connections).where(Connections.id.in_(batch)))
+    for session, batch in batches(added_connections):
+        session.execute(insert(Connections), batch)
+    for session, batch in batches(removed_devices):
+        path_store.invalidate_devices(session, batch)
+        session.execute(delete(Devices).where(Devices.name.in_(batch)))
+
+    elapsed = time.perf_counter() - start
+    written = (len(added_devices) + len(changed_devices) + len(removed_devices)
+               + len(added_connections) + len(removed_connections))
+    print(f"Synced {written} rows in {elapsed:.2f}s, stored paths "
+          f"{'kept' if keep_stored_paths else 'cleared'}")
+
+
 def create_parser():
     parser = argparse.ArgumentParser("Driver for Bulk Insert")
     parser.add_argument("--host", default="172.18.0.1", help="Host IP Address", type=str)
     parser.add_argument("--file", default="InputData.csv", help="Path to csv file to process", type=str)
+    parser.add_argument("--fast", action="store_true", help="Chunked, vectorised ingestion with batched executemany")
+    parser.add_argument("--sync", action="store_true", help="Only write the difference between the csv and the database")
+    parser.add_argument("--dry-run", action="store_true", help="Report the --sync difference without writing it")
+    parser.add_argument("--chunksize", default=10000, help="Rows read per csv chunk in --fast and --sync mode", type=int)
+    parser.add_argument("--batch-size", default=1000, help="Rows per transaction in --fast and --sync mode", type=int)
     return parser.parse_args()
 
 
 if __name__ == "__main__":
     args = create_parser()
 
-    # Read df
-    df = pd.read_csv(args.file)
-
     # Make session and engine
     connection_url = URL.create(
         f"{DATABASE}+{DIALECT}",
@@ -72,10 +261,19 @@ if __name__ == "__main__":
         }
     )
 
-    engine = create_engine(connection_url)
+    engine = create_engine(connection_url, fast_executemany=True)
     Session = sessionmaker(engine)
     Base.metadata.create_all(engine)
-    devices, connections = process_csv(df)
 
-    # Mass insert
-    bulk_insert(devices, connections, Session)
+    if args.sync:
+        sync(args.file, engine, args.chunksize, args.batch_size, args.dry_run)
+    elif args.fast:
+        chunked_bulk_insert(args.file, engine, args.chunksize, args.batch_size)
+    else:
+        # Read df
+        df = pd.read_csv(args.file)
+        devices, connections = process_csv(df)
+
+        # Mass insert
+        bulk_insert(devices, connections, Session)
+
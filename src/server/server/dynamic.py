@@ -0,0 +1,187 @@
+from heapq import heappop, heappush
+from typing import NamedTuple
+
+from routing import INF, Graph
+
+
+# Dynamic layer over routing.Graph: device status/cost toggles and connection
+# cost updates are applied to a copy of the cached graph as deltas, and the
+# shortest path trees cached on it are repaired instead of recomputed.
+
+class DeviceChange(NamedTuple):
+    name: str
+    available: bool
+    cost: int
+
+
+class ConnectionChange(NamedTuple):
+    src: str
+    dst: str
+    cost: int
+
+
+def apply_change(G: Graph, change: DeviceChange | ConnectionChange) -> Graph | None:
+    # New graph with the change applied, or None when it cannot be expressed
+    # as a delta on G (a device or connection G was built without)
+    if isinstance(change, DeviceChange):
+        return _apply_device_change(G, change)
+    return _apply_connection_change(G, change)
+
+
+def may_improve(
+        G: Graph,
+        change: DeviceChange | ConnectionChange,
+        src: str,
+        dst: str,
+        bound: float
+) -> bool:
+    # Whether a path from src through the changed element can now cost at
+    # most `bound`, the K-th stored cost plus the dst device cost (INF when
+    # fewer than K paths were found). Device costs and connection costs are
+    # non-negative, so reaching the element already has to fit in the bound.
+    if src not in G:
+        return True
+    s = G.node_id(src)
+    dist = G.shortest_path_tree(s)[0]
+    if isinstance(change, DeviceChange):
+        v = G.node_id(change.name)
+        return v != s and dist.get(v, INF) <= bound
+    u, v = G.node_id(change.src), G.node_id(change.dst)
+    return dist.get(u, INF) + change.cost + G._device_cost[v] <= bound
+
+
+def _apply_device_change(G: Graph, change: DeviceChange) -> Graph | None:
+    if change.name not in G._index:
+        # Out of service when the graph was built, nothing to do unless it
+        # comes back
+        return None if change.available else G
+    v = G.node_id(change.name)
+    was_available = not G._disabled[v]
+    old_cost = G._device_cost[v]
+    if was_available == change.available and old_cost == change.cost:
+        return G
+
+    H = G.copy()
+    H._device_cost[v] = change.cost
+    H._disabled[v] = not change.available
+    improved = change.available and (not was_available or change.cost < old_cost)
+    worsened = was_available and (not change.available or change.cost > old_cost)
+    for src, tree in _cached_trees(G):
+        if src == v:
+            # The source device cost is never paid
+            if change.available:
+                H.trees[src] = tree
+        elif improved:
+            H.trees[src] = _repair_decrease(H, tree, v, _best_parent(H, tree[0], v))
+        elif worsened:
+            H.trees[src] = _repair_increase(H, tree, v)
+        else:
+            H.trees[src] = tree
+    return H
+
+
+def _apply_connection_change(G: Graph, change: ConnectionChange) -> Graph | None:
+    if change.src not in G._index or change.dst not in G._index:
+        return None
+    u, v = G.node_id(change.src), G.node_id(change.dst)
+    forward = [
+        i for i in range(G._offsets[u], G._offsets[u + 1]) if G._targets[i] == v
+    ]
+    if not forward:
+        return None
+    old_cost = G._weights[forward[0]]
+    if old_cost == change.cost:
+        return G
+
+    H = G.copy()
+    H._weights[forward[0]] = change.cost
+    for i in range(H._rev_offsets[v], H._rev_offsets[v + 1]):
+        if H._rev_sources[i] == u:
+            H._rev_weights[i] = change.cost
+    for src, tree in _cached_trees(G):
+        dist, parent = tree
+        if change.cost < old_cost and u in dist and not H._disabled[v]:
+            candidate = (dist[u] + change.cost + H._device_cost[v], u)
+            H.trees[src] = _repair_decrease(H, tree, v, candidate)
+        elif change.cost > old_cost and parent.get(v) == u:
+            H.trees[src] = _repair_increase(H, tree, v)
+        else:
+            H.trees[src] = tree
+    return H
+
+
+def _cached_trees(G: Graph) -> list:
+    # Queries on G add and evict trees while a change is applied
+    with G._trees_lock:
+        return list(G.trees.items())
+
+
+def _best_parent(H: Graph, dist: dict, v: int):
+    best = (INF, -1)
+    for p, w in H.predecessors(v):
+        if p in dist:
+            best = min(best, (dist[p] + w + H._device_cost[v], p))
+    return best
+
+
+def _repair_decrease(H: Graph, tree, v: int, candidate):
+    # v can now be reached via candidate = (dist, parent), improvements
+    # propagate from v only as far as they lower distances
+    dist, parent = tree
+    if candidate[0] >= dist.get(v, INF):
+        return tree
+    dist, parent = dict(dist), dict(parent)
+    dist[v], parent[v] = candidate
+    _propagate(H, dist, parent, [(dist[v], v)])
+    return dist, parent
+
+
+def _repair_increase(H: Graph, tree, v: int):
+    # Only the subtree hanging below v can get longer. Its distances are
+    # dropped and recomputed from the unaffected boundary.
+    dist, parent = tree
+    if v not in dist:
+        return tree
+    children = {}
+    for node, p in parent.items():
+        children.setdefault(p, []).append(node)
+    affected = set()
+    stack = [v]
+    while stack:
+        node = stack.pop()
+        affected.add(node)
+        stack.extend(children.get(node, ()))
+
+    dist = {node: d for node, d in dist.items() if node not in affected}
+    parent = {node: p for node, p in parent.items() if node not in affected}
+    heap = []
+    for node in affected:
+        if H._disabled[node]:
+            continue
+        best = (INF, -1)
+        for p, w in H.predecessors(node):
+            if p in dist:
+                best = min(best, (dist[p] + w + H._device_cost[node], p))
+        if best[0] < INF:
+            dist[node], parent[node] = best
+            heappush(heap, (best[0], node))
+    _propagate(H, dist, parent, heap)
+    return dist, parent
+
+
+def _propagate(H: Graph, dist: dict, parent: dict, heap: list) -> None:
+    offsets, targets, weights = H._offsets, H._targets, H._weights
+    device_cost, disabled = H._device_cost, H._disabled
+    while heap:
+        d, u = heappop(heap)
+        if d > dist.get(u, INF):
+            continue
+        for i in range(offsets[u], offsets[u + 1]):
+            w = targets[i]
+            if disabled[w]:
+                continue
+            nd = d + weights[i] + device_cost[w]
+            if nd < dist.get(w, INF):
+                dist[w] = nd
+                parent[w] = u
+                heappush(heap, (nd, w))
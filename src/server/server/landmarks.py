@@ -0,0 +1,98 @@
+import time
+from array import array
+from heapq import heappop, heappush
+
+from routing import INF, Graph
+
+
+# ALT index: distances from and to a handful of landmark devices. By the
+# triangle inequality d(L, t) - d(L, v) and d(v, L) - d(t, L) are lower
+# bounds on d(v, t), which the path search uses as an A* heuristic.
+class LandmarkIndex:
+
+    def __init__(self, G: Graph, num_landmarks: int) -> None:
+        start = time.perf_counter()
+        self.landmarks = []
+        self._from = []
+        self._to = []
+
+        n = len(G)
+        if n > 0 and num_landmarks > 0:
+            # Farthest point selection, seeded with the best connected device
+            score = array("d", [INF]) * n
+            landmark = max(
+                range(n),
+                key=lambda v: G._offsets[v + 1] - G._offsets[v]
+                + G._rev_offsets[v + 1] - G._rev_offsets[v]
+            )
+            while len(self.landmarks) < min(num_landmarks, n):
+                self.landmarks.append(landmark)
+                self._from.append(_distances(G, landmark, reverse=False))
+                self._to.append(_distances(G, landmark, reverse=True))
+                for v in range(n):
+                    fwd, bwd = self._from[-1][v], self._to[-1][v]
+                    reach = (fwd if fwd < INF else 0) + (bwd if bwd < INF else 0)
+                    score[v] = min(score[v], reach)
+                for v in self.landmarks:
+                    score[v] = -1
+                landmark = max(range(n), key=score.__getitem__)
+
+        self.build_seconds = time.perf_counter() - start
+
+    def heuristic(self, target: int):
+        columns = [
+            (fwd, fwd[target], bwd, bwd[target])
+            for fwd, bwd in zip(self._from, self._to)
+        ]
+
+        def lower_bound(v: int) -> float:
+            # INF when some landmark proves v cannot reach target
+            best = 0
+            for fwd, fwd_target, bwd, bwd_target in columns:
+                if fwd[v] < INF:
+                    if fwd_target >= INF:
+                        return INF
+                    best = max(best, fwd_target - fwd[v])
+                if bwd_target < INF:
+                    if bwd[v] >= INF:
+                        return INF
+                    best = max(best, bwd[v] - bwd_target)
+            return best
+
+        return lower_bound
+
+    def memory_usage(self) -> int:
+        return sum(a.itemsize * len(a) for a in self._from + self._to)
+
+    def status(self, G: Graph) -> dict:
+        return {
+            "landmarks": [G.node_name(v) for v in self.landmarks],
+            "build_ms": self.build_seconds * 1000,
+            "bytes": self.memory_usage(),
+        }
+
+
+def _distances(G: Graph, landmark: int, reverse: bool) -> array:
+    # Full Dijkstra from the landmark, or towards it over incoming
+    # connections. Entering a node costs its device cost in both cases.
+    if reverse:
+        offsets, nodes, weights = G._rev_offsets, G._rev_sources, G._rev_weights
+    else:
+        offsets, nodes, weights = G._offsets, G._targets, G._weights
+    device_cost = G._device_cost
+    dist = array("d", [INF]) * len(G)
+    dist[landmark] = 0
+    heap = [(0, landmark)]
+    while heap:
+        d, u = heappop(heap)
+        if d > dist[u]:
+            continue
+        for i in range(offsets[u], offsets[u + 1]):
+            v = nodes[i]
+            if G._disabled[v]:
+                continue
+            nd = d + weights[i] + (device_cost[u] if reverse else device_cost[v])
+            if nd < dist[v]:
+                dist[v] = nd
+                heappush(heap, (nd, v))
+    return dist
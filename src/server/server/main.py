@@ -1,45 +1,131 @@
-from typing import Annotated
+import io
+import json
+import logging
+import random
+import time
+from heapq import merge
+from operator import itemgetter
+from typing import Annotated, Literal
 
 import fastapi
-from fastapi import HTTPException, Query
-from sqlalchemy import create_engine, insert, select, update
+import numpy as np
+from pydantic import ValidationError
+from fastapi import Body, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, \
+    StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, event, insert, or_, select, update
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import aliased, sessionmaker
 from sqlalchemy.sql.operators import and_
 
-from routing import Graph, k_shortest_path, multilple_dest_path
-from schema import Base, ConnectionData, Connections, DeviceData, Devices
-from settings import connection_url
+import compute
+import dynamic
+import metrics
+import path_store
+from cache import GraphCache
+from coalesce import SingleFlight
+from landmarks import LandmarkIndex
+from reachability import ReachabilityIndex
+from routing import INF, Constraints, Graph, batch_k_shortest_path, cost_matrix, \
+    disjoint_paths, iter_k_shortest_path, k_shortest_path_with_stats, multicast_tree, \
+    multilple_dest_path
+from schema import Base, ConnectionData, Connections, DeviceData, Devices, \
+    PathQuery
+from settings import GRAPH_CACHE_TTL, GRAPH_SNAPSHOT_PATH, MAX_COMBINED_DESTINATIONS, \
+    NUM_LANDMARKS, SQL_TRACE_SAMPLE, connection_url
+from snapshot import GraphSnapshot
+
+logger = logging.getLogger("main")
 
 # Create engine
-engine = create_engine(connection_url, echo=True)
+engine = create_engine(connection_url)
 Session = sessionmaker(engine)
+
+
+# Statement timings replace the engine echo: every statement is measured,
+# a sampled fraction is logged
+@event.listens_for(engine, "before_cursor_execute")
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    operation = (statement.split(None, 1) or [""])[0].lower()
+    metrics.DB_QUERY_SECONDS.observe(elapsed, operation=operation)
+    if SQL_TRACE_SAMPLE > 0 and random.random() < SQL_TRACE_SAMPLE:
+        logger.info("%.2f ms %s %r", elapsed * 1000, statement, parameters)
+
+
+@event.listens_for(engine, "handle_error")
+def discard_query_timer(context):
+    # A statement that raised never reaches after_cursor_execute
+    if context.connection is not None and context.connection.info.get("query_start"):
+        context.connection.info["query_start"].pop()
+
+
 Base.metadata.create_all(engine)
 
+# Edits made while the API was down did not bump the graph version, every
+# process starts from a new version without stored paths
+for attempt in range(2):
+    with Session() as session:
+        try:
+            path_store.bump_version(session)
+            path_store.clear(session)
+            session.commit()
+            break
+        except IntegrityError:
+            # The version row was created by a process starting alongside
+            session.rollback()
+
 # Create fastapi
 app = fastapi.FastAPI()
+app.add_event_handler("shutdown", compute.shutdown)
 
 # Type Def
 DeviceName = Annotated[str | None, Query(title="Device Name", max_length=30)]
 DeviceNameRequired = Annotated[str, Query(title="Device Name", max_length=30)]
 ListDeviceNameRequired = Annotated[
     DeviceNameRequired | list[DeviceNameRequired], Query()]
+PageLimit = Annotated[int, Query(title="Page size", ge=1, le=10000)]
+Algorithm = Annotated[
+    Literal["yen", "legacy"], Query(title="K shortest path algorithm")]
+DeviceList = Annotated[
+    str | None, Query(title="Comma separated device names")]
+ConnectionList = Annotated[
+    str | None, Query(title="Comma separated connections as SRC>DST")]
+Search = Annotated[
+    Literal["auto", "forward", "bidirectional"],
+    Query(title="Search strategy of the yen algorithm")]
 
 
 @app.get("/devices/")
 def get_devices(
+        response: Response,
         name: DeviceName = None,
-        status: int | None = None
+        status: int | None = None,
+        after: DeviceName = None,
+        limit: PageLimit = 1000
 ) -> list[DeviceData]:
+    # Keyset pagination on the device name: pass the X-Next-After header of
+    # a full page as `after` to get the next one
     with Session() as session:
-        query = select(Devices)
+        query = select(Devices).order_by(Devices.name).limit(limit)
         if name is not None:
             query = query.where(Devices.name == name)
         if status is not None:
             query = query.where(Devices.status == status)
+        if after is not None:
+            query = query.where(Devices.name > after)
         result = session.scalars(query).all()
-        if len(result) == 0:
+        # A page after the last device is just empty, like in get_connections
+        if len(result) == 0 and after is None:
             raise HTTPException(status_code=404, detail="Device not exist on database")
+    if len(result) == limit:
+        response.headers["X-Next-After"] = result[-1].name
     return result
 
 
@@ -51,9 +137,11 @@ def insert_devices(
         src_exist = session.query(Devices).filter(Devices.name == devices.name).first()
         if not src_exist:
             try:
+                versions = path_store.bump_version(session)
                 insert_stmt = insert(Devices).values(devices.model_dump())
                 session.execute(insert_stmt)
-                session.commit()
+                # A new device has no connections yet, stored paths stay valid
+                invalidate_graph(session, versions, keep_stored_paths=True)
             except IntegrityError as e:
                 session.rollback()
                 raise HTTPException(status_code=406, detail=str(e))
@@ -74,11 +162,27 @@ def update_devices(
         src_exist = session.query(Devices).filter(Devices.name == devices.name).first()
         if src_exist:
             try:
+                # Taking a device out of service or raising its cost can only
+                # break stored paths through it, anything else may open up
+                # cheaper paths anywhere
+                keep_stored_paths = devices.status != 0 or (
+                    src_exist.status == 0 and devices.cost >= src_exist.cost
+                )
+                versions = path_store.bump_version(session)
+                if keep_stored_paths:
+                    path_store.invalidate_device(session, devices.name)
                 update_stmt = update(Devices).where(
                     Devices.name == devices.name
                 ).values(devices.model_dump())
                 session.execute(update_stmt)
-                session.commit()
+                apply_graph_change(
+                    session,
+                    versions,
+                    dynamic.DeviceChange(
+                        devices.name, devices.status == 0, devices.cost
+                    ),
+                    may_improve=not keep_stored_paths
+                )
             except IntegrityError as e:
                 session.rollback()
                 raise HTTPException(status_code=406, detail=str(e))
@@ -102,25 +206,83 @@ def remove_device(
                     status_code=404,
                     detail="Cannot delete device that does not exist on db"
                 )
+            versions = path_store.bump_version(session)
+            path_store.invalidate_device(session, name)
             session.delete(item)
-            session.commit()
+            invalidate_graph(session, versions, keep_stored_paths=True)
         except IntegrityError as e:
             session.rollback()
             raise HTTPException(status_code=406, detail=str(e))
 
 
+@app.post("/batch/devices/")
+def upsert_devices(
+        items: list[dict] = Body(...),
+) -> list[dict]:
+    # Insert or update a batch of devices in one transaction. Items are
+    # validated one by one and reported individually, existing devices are
+    # looked up with a few set-based queries instead of one per item.
+    results, devices = validate_batch(items, DeviceData, lambda item: item.name)
+    names = [item.name for _, item in devices]
+    with Session() as session:
+        existing = {}
+        for start in range(0, len(names), 1000):
+            for row in session.execute(
+                    select(Devices.name, Devices.status, Devices.cost)
+                    .where(Devices.name.in_(names[start:start + 1000]))
+            ):
+                existing[row.name] = row
+        inserts, updates, worsened = [], [], []
+        keep_stored_paths = True
+        for i, item in devices:
+            old = existing.get(item.name)
+            if old is None:
+                inserts.append(item.model_dump())
+                results[i]["result"] = "inserted"
+                continue
+            updates.append(item.model_dump())
+            results[i]["result"] = "updated"
+            # Same rule as update_devices
+            if item.status != 0 or (old.status == 0 and item.cost >= old.cost):
+                worsened.append(item.name)
+            else:
+                keep_stored_paths = False
+        if not devices:
+            return results
+        try:
+            versions = path_store.bump_version(session)
+            path_store.invalidate_devices(session, worsened)
+            if inserts:
+                session.execute(insert(Devices), inserts)
+            if updates:
+                session.execute(update(Devices), updates)
+            invalidate_graph(session, versions, keep_stored_paths)
+        except IntegrityError as e:
+            session.rollback()
+            raise HTTPException(status_code=406, detail=str(e))
+    return results
+
+
 @app.get("/connections/")
 def get_connections(
+        response: Response,
         src: DeviceName = None,
-        dst: DeviceName = None
+        dst: DeviceName = None,
+        after: int | None = None,
+        limit: PageLimit = 1000
 ) -> list[ConnectionData]:
+    # Keyset pagination on the connection id, see get_devices
     with Session() as session:
-        query = select(Connections)
+        query = select(Connections).order_by(Connections.id).limit(limit)
         if src is not None:
             query = query.where(Connections.src == src)
         if dst is not None:
             query = query.where(Connections.dst == dst)
+        if after is not None:
+            query = query.where(Connections.id > after)
         result = session.scalars(query).all()
+    if len(result) == limit:
+        response.headers["X-Next-After"] = str(result[-1].id)
     return result
 
 
@@ -169,6 +331,12 @@ def insert_connections(
             Connections.dst == connection.dst
         ).first()
         if path_exist:
+            keep_stored_paths = connection.cost >= path_exist.cost
+            versions = path_store.bump_version(session)
+            if keep_stored_paths:
+                path_store.invalidate_connection(
+                    session, connection.src, connection.dst
+                )
             update_stmt = update(Connections).where(
                 and_(
                     Connections.src == connection.src,
@@ -176,13 +344,21 @@ def insert_connections(
                 )
             ).values(cost=connection.cost)
             session.execute(update_stmt)
-            session.commit()
+            apply_graph_change(
+                session,
+                versions,
+                dynamic.ConnectionChange(
+                    connection.src, connection.dst, connection.cost
+                ),
+                may_improve=not keep_stored_paths
+            )
             return connection.model_dump()
         try:
             # Otherwise execute the insert statement
+            versions = path_store.bump_version(session)
             insert_stmt = insert(Connections).values(connection.model_dump())
             session.execute(insert_stmt)
-            session.commit()
+            invalidate_graph(session, versions, keep_stored_paths=False)
         except IntegrityError as e:
             session.rollback()
             raise HTTPException(status_code=406, detail=str(e))
@@ -200,60 +376,519 @@ def remove_connections(
                 Connections.dst == connection.dst
             )
             item = session.scalars(select_stmt).first()
+            versions = path_store.bump_version(session)
+            path_store.invalidate_connection(
+                session, connection.src, connection.dst
+            )
             session.delete(item)
-            session.commit()
+            invalidate_graph(session, versions, keep_stored_paths=True)
         except IntegrityError as e:
             session.rollback()
             raise HTTPException(status_code=406, detail=str(e))
 
 
-def create_graph_from_database_data() -> Graph:
-    # only get available devices
-    devices = get_devices(status=0)
-    device_list = [(device.name, device.cost) for device in devices]
+@app.post("/batch/connections/")
+def upsert_connections(
+        items: list[dict] = Body(...),
+) -> list[dict]:
+    # Batch version of insert_connections: device existence and the
+    # unidirectional rule are checked for the whole batch with a few
+    # set-based queries, all changes go through in one transaction.
+    results, connections = validate_batch(
+        items, ConnectionData, lambda item: frozenset((item.src, item.dst))
+    )
+    names = list({name for _, item in connections for name in (item.src, item.dst)})
+    with Session() as session:
+        known = set()
+        existing = {}
+        for start in range(0, len(names), 1000):
+            batch = names[start:start + 1000]
+            known.update(session.scalars(
+                select(Devices.name).where(Devices.name.in_(batch))
+            ))
+            for row in session.execute(
+                    select(Connections.id, Connections.src, Connections.dst,
+                           Connections.cost)
+                    .where(Connections.src.in_(batch))
+            ):
+                existing[row.src, row.dst] = row
+        inserts, updates, worsened = [], [], []
+        keep_stored_paths = True
+        for i, item in connections:
+            missing = [name for name in (item.src, item.dst) if name not in known]
+            if missing:
+                results[i]["error"] = (
+                    f"Device was not registered. Device name: {', '.join(missing)}"
+                )
+                continue
+            if (item.dst, item.src) in existing:
+                results[i]["error"] = (
+                    f"Unidirectional requirement violated. An anti-path "
+                    f"({item.dst},{item.src}) already exists."
+                )
+                continue
+            old = existing.get((item.src, item.dst))
+            if old is None:
+                inserts.append(item.model_dump())
+                results[i]["result"] = "inserted"
+                keep_stored_paths = False
+                continue
+            updates.append({"id": old.id, "cost": item.cost})
+            results[i]["result"] = "updated"
+            if item.cost >= old.cost:
+                worsened.append(old.id)
+            else:
+                keep_stored_paths = False
+        if not inserts and not updates:
+            return results
+        try:
+            versions = path_store.bump_version(session)
+            path_store.invalidate_connections(session, worsened)
+            if inserts:
+                session.execute(insert(Connections), inserts)
+            if updates:
+                session.execute(update(Connections), updates)
+            invalidate_graph(session, versions, keep_stored_paths)
+        except IntegrityError as e:
+            session.rollback()
+            raise HTTPException(status_code=406, detail=str(e))
+    return results
 
-    # only get connections of available devices
-    devices_name = set(device for device, _ in device_list)
-    connections = get_connections()
-    connection_list = [(con.src, con.dst, con.cost) for con in connections if (con.src in devices_name and con.dst in devices_name)]
+
+def validate_batch(items: list[dict], model, key) -> tuple[list[dict], list]:
+    # Per item results in request order and the (index, model) pairs that
+    # passed validation. Items repeating an earlier key are rejected.
+    results = []
+    valid = []
+    seen = set()
+    for i, item in enumerate(items):
+        result = {"item": item}
+        results.append(result)
+        try:
+            data = model.model_validate(item)
+        except ValidationError as e:
+            result["error"] = "; ".join(
+                f"{'.'.join(map(str, error['loc']))}: {error['msg']}"
+                if error["loc"] else error["msg"]
+                for error in e.errors()
+            )
+            continue
+        if key(data) in seen:
+            result["error"] = "Conflicts with an earlier item in the batch"
+            continue
+        seen.add(key(data))
+        valid.append((i, data))
+    return results, valid
+
+
+def create_graph_from_database_data() -> Graph:
+    # Available devices with their connections to available devices, as one
+    # row per (device, outgoing connection) or (device, None) when it has none
+    dst_device = aliased(Devices)
+    connections = (
+        select(Connections.src, Connections.dst, Connections.cost, Connections.id)
+        .join(dst_device, dst_device.name == Connections.dst)
+        .where(dst_device.status == 0)
+        .subquery()
+    )
+    query = (
+        select(Devices.name, Devices.cost, connections.c.dst, connections.c.cost)
+        .outerjoin(connections, connections.c.src == Devices.name)
+        .where(Devices.status == 0)
+        .order_by(Devices.name, connections.c.id)
+    )
+    device_list = []
+    connection_list = []
+    with engine.connect() as conn:
+        for name, cost, dst, connection_cost in conn.execute(query):
+            if not device_list or device_list[-1][0] != name:
+                device_list.append((name, cost))
+            if dst is not None:
+                connection_list.append((name, dst, connection_cost))
 
     return Graph(device_list, connection_list)
 
 
+def index_graph(G: Graph, reachability: ReachabilityIndex | None = None) -> Graph:
+    G.reachability = reachability or ReachabilityIndex(G)
+    if NUM_LANDMARKS > 0:
+        G.landmarks = LandmarkIndex(G, NUM_LANDMARKS)
+    return G
+
+
+def load_graph() -> Graph:
+    return index_graph(create_graph_from_database_data())
+
+
+def read_graph_version() -> int:
+    with Session() as session:
+        return path_store.current_version(session)
+
+
+def bump_graph_version() -> None:
+    # An out-of-band edit found by a ttl reload may have made any path
+    # cheaper
+    with Session() as session:
+        path_store.bump_version(session)
+        path_store.clear(session)
+        session.commit()
+
+
+graph_cache = GraphCache(
+    load_graph,
+    read_graph_version,
+    bump_graph_version,
+    GRAPH_CACHE_TTL,
+    GraphSnapshot(GRAPH_SNAPSHOT_PATH, prepare=index_graph) if GRAPH_SNAPSHOT_PATH else None
+)
+best_paths_flight = SingleFlight("best_paths")
+combined_paths_flight = SingleFlight("combined_paths")
+cost_matrix_flight = SingleFlight("cost_matrix")
+# Cost matrices of the current graph version by (version, sources,
+# destinations)
+cost_matrices = {}
+
+
+def invalidate_graph(
+        session,
+        versions: tuple[int, int],
+        keep_stored_paths: bool
+) -> None:
+    # Commit a write that bumped the graph version to versions[1]. Stored
+    # paths that survived a targeted invalidation are carried over to the new
+    # version, otherwise the write may have created cheaper paths and every
+    # stored path is dropped. Processes reload the graph on the new version.
+    if keep_stored_paths:
+        path_store.restamp(session, *versions)
+    else:
+        path_store.clear(session)
+    session.commit()
+
+
+def apply_graph_change(
+        session,
+        versions: tuple[int, int],
+        change: dynamic.DeviceChange | dynamic.ConnectionChange,
+        may_improve: bool
+) -> None:
+    # Commit a status or cost update, applied to the cached graph as a delta.
+    # Paths it can only make worse were already invalidated, an improvement
+    # drops just the stored results it can beat.
+    old_version, new_version = versions
+    G = graph_cache.peek(old_version)
+    H = dynamic.apply_change(G, change) if G is not None else None
+    if not may_improve:
+        path_store.restamp(session, old_version, new_version)
+    elif H is None:
+        path_store.clear(session)
+    else:
+        for src, dst, K, cost, count in path_store.stored_results(session, old_version):
+            bound = cost + H.get_device_cost(dst) if count == K else INF
+            if dynamic.may_improve(H, change, src, dst, bound):
+                path_store.delete_result(session, src, dst, K)
+        path_store.restamp(session, old_version, new_version)
+    session.commit()
+    if H is not None and H is not G:
+        # Landmark distances are only consistent for the costs they were
+        # computed on, reachability only changes with the devices in service
+        index_graph(H, G.reachability if H._disabled == G._disabled else None)
+    graph_cache.advance(old_version, new_version, H)
+
+
+@app.get("/metrics")
+def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+@app.get("/graph/status")
+def get_graph_status() -> dict:
+    return graph_cache.status()
+
+
+@app.get("/graph/landmarks")
+def get_landmark_status() -> dict:
+    G = graph_cache.get()
+    if G.landmarks is None:
+        raise HTTPException(status_code=404, detail="Landmark index is disabled")
+    return G.landmarks.status(G)
+
+
+@app.get("/graph/reachability")
+def get_reachability_status() -> dict:
+    return graph_cache.get().reachability.status()
+
+
+def stage(endpoint: str, name: str):
+    return metrics.STAGE_SECONDS.time(endpoint=endpoint, stage=name)
+
+
+def validate_path_query(
+        G: Graph,
+        src: str,
+        dst: list[str]
+) -> list[str]:
+    if src not in G:
+        raise HTTPException(
+            status_code=404, detail=f"src device: {src} not exist on database"
+        )
+
+    # remove spaces
+    dst_list = [dst_node.strip() for dst_node in dst[0].split(",")]
+
+    for dst_node in dst_list:
+        if dst_node not in G:
+            raise HTTPException(
+                status_code=404, detail=f"dst device {dst_node} not exist on database"
+            )
+    return dst_list
+
+
+def validate_constraints(
+        G: Graph,
+        src: str,
+        dst_list: list[str],
+        avoid: str | None,
+        avoid_connections: str | None,
+        waypoints: str | None,
+        max_hops: int | None,
+        max_cost: int | None
+) -> Constraints | None:
+    avoid_list = split_names(avoid)
+    waypoint_list = split_names(waypoints)
+    connection_list = []
+    for pair in split_names(avoid_connections):
+        connection = tuple(name.strip() for name in pair.split(">"))
+        if len(connection) != 2:
+            raise HTTPException(
+                status_code=422,
+                detail=f"Connection {pair} is not written as SRC>DST"
+            )
+        connection_list.append(connection)
+
+    for name in [*avoid_list, *waypoint_list]:
+        if name not in G:
+            raise HTTPException(
+                status_code=404, detail=f"device {name} not exist on database"
+            )
+    for u, v in connection_list:
+        if u not in G or v not in (G[u] or {}):
+            raise HTTPException(
+                status_code=404,
+                detail=f"connection ({u},{v}) not exist on database"
+            )
+    endpoints = {src, *dst_list}
+    conflicts = (endpoints | set(waypoint_list)) & set(avoid_list)
+    if conflicts:
+        raise HTTPException(
+            status_code=422,
+            detail=f"devices {', '.join(sorted(conflicts))} are both required and avoided"
+        )
+    if endpoints & set(waypoint_list) or len(set(waypoint_list)) != len(waypoint_list):
+        raise HTTPException(
+            status_code=422,
+            detail="waypoints must be distinct from each other, src and dst"
+        )
+
+    constraints = Constraints(
+        frozenset(avoid_list),
+        frozenset(connection_list),
+        tuple(waypoint_list),
+        max_hops,
+        max_cost
+    )
+    return None if constraints == Constraints() else constraints
+
+
+def split_names(names: str | None) -> list[str]:
+    if not names:
+        return []
+    return [name.strip() for name in names.split(",") if name.strip()]
+
+
+def load_stored_paths(
+        src: str,
+        dst_list: list[str],
+        K: int,
+        version: int
+) -> dict:
+    result = {}
+    with Session() as session:
+        for dst_node in dst_list:
+            stored = path_store.load_best_paths(session, src, dst_node, K, version)
+            if stored is not None:
+                result[dst_node] = stored
+    return result
+
+
+def save_stored_paths(src: str, result: dict, K: int, version: int) -> None:
+    with Session() as session:
+        for dst_node, paths in result.items():
+            path_store.save_best_paths(session, src, dst_node, K, version, paths)
+        session.commit()
+
+
 @app.get("/best/paths/")
-def get_best_path(
+async def get_best_path(
         src: DeviceNameRequired,
         dst: ListDeviceNameRequired,
         num_best_path: int = 5,
+        algorithm: Algorithm = "yen",
+        search: Search = "auto",
+        avoid: DeviceList = None,
+        avoid_connections: ConnectionList = None,
+        waypoints: DeviceList = None,
+        max_hops: Annotated[int | None, Query(ge=1)] = None,
+        max_cost: Annotated[int | None, Query(ge=0)] = None,
 ):
     if not src:
         raise HTTPException(status_code=404, detail="src device is required")
     if not dst:
         raise HTTPException(status_code=404, detail="dst device is required")
-    G = create_graph_from_database_data()
-
-    if not any(src == vertex[0] for vertex in G.vertices):
+    with stage("best_paths", "graph_load"):
+        G, version = await run_in_threadpool(graph_cache.snapshot)
+    with stage("best_paths", "validation"):
+        dst_list = validate_path_query(G, src, dst)
+        constraints = validate_constraints(
+            G, src, dst_list, avoid, avoid_connections, waypoints, max_hops,
+            max_cost
+        )
+    if constraints is not None and algorithm != "yen":
         raise HTTPException(
-            status_code=404, detail=f"src device: {src} not exist on database"
+            status_code=422, detail="Constraints require the yen algorithm"
         )
-    
-    dst_list = dst[0].split(",")
-    for i in range(len(dst_list)):
-        dst_list[i] = dst_list[i].strip()
 
-    for dst_node in dst_list:
-        if not any(dst_node == vertex[0] for vertex in G.vertices):
-            raise HTTPException(
-                status_code=404, detail=f"dst device {dst_node} not exist on database"
+    # Concurrent identical queries share one computation
+    targets = tuple(sorted(set(dst_list)))
+    result, expanded = await best_paths_flight.run(
+        (src, targets, num_best_path, version, algorithm, search, constraints),
+        lambda: find_best_paths(
+            G, version, src, list(targets), num_best_path, algorithm, search,
+            constraints
+        )
+    )
+    with stage("best_paths", "serialization"):
+        return JSONResponse(
+            {dst_node: result[dst_node] for dst_node in dst_list},
+            headers={"X-Search-Expansions": str(expanded)}
+        )
+
+
+async def find_best_paths(
+        G: Graph,
+        version: int,
+        src: str,
+        dst_list: list[str],
+        num_best_path: int,
+        algorithm: str,
+        search: str,
+        constraints: Constraints | None
+) -> tuple[dict, int]:
+    # Pairs without any path are answered without a search
+    unreachable = {
+        dst_node: [] for dst_node in dst_list if not G.reachable(src, dst_node)
+    }
+    dst_list = [dst_node for dst_node in dst_list if dst_node not in unreachable]
+    if not dst_list:
+        return unreachable, 0
+
+    # Constrained results are not stored, they are computed every time
+    if algorithm != "yen" or constraints is not None:
+        with stage("best_paths", "search"):
+            result, stats = await compute.run_routing(
+                G, version, k_shortest_path_with_stats, src, dst_list,
+                num_best_path, algorithm, search, constraints
             )
+        metrics.record_search("best_paths", stats)
+        return {**result, **unreachable}, stats["expanded"]
+
+    # Serve repeat queries from the stored paths of this graph version
+    with stage("best_paths", "store"):
+        result = await run_in_threadpool(
+            load_stored_paths, src, dst_list, num_best_path, version
+        )
+    missing = [dst_node for dst_node in dst_list if dst_node not in result]
+    expanded = 0
+    if missing:
+        with stage("best_paths", "search"):
+            computed, stats = await compute.run_routing(
+                G, version, k_shortest_path_with_stats, src, missing,
+                num_best_path, algorithm, search
+            )
+        metrics.record_search("best_paths", stats)
+        expanded = stats["expanded"]
+        with stage("best_paths", "store"):
+            await run_in_threadpool(
+                save_stored_paths, src, computed, num_best_path, version
+            )
+        result.update(computed)
+    return {**result, **unreachable}, expanded
+
+
+@app.get("/best/paths/stream")
+async def stream_best_path(
+        src: DeviceNameRequired,
+        dst: ListDeviceNameRequired,
+        request: Request,
+        num_best_path: int = 5,
+        search: Search = "auto",
+        avoid: DeviceList = None,
+        avoid_connections: ConnectionList = None,
+        waypoints: DeviceList = None,
+        max_hops: Annotated[int | None, Query(ge=1)] = None,
+        max_cost: Annotated[int | None, Query(ge=0)] = None,
+):
+    # NDJSON stream of the paths to every dst in cost order. Each path is
+    # sent as soon as the search finalizes it and the search stops when the
+    # client goes away. The generator is driven from the thread pool, it
+    # cannot be handed over to the routing processes.
+    if not src:
+        raise HTTPException(status_code=404, detail="src device is required")
+    if not dst:
+        raise HTTPException(status_code=404, detail="dst device is required")
+    G, version = await run_in_threadpool(graph_cache.snapshot)
+    dst_list = validate_path_query(G, src, dst)
+    constraints = validate_constraints(
+        G, src, dst_list, avoid, avoid_connections, waypoints, max_hops, max_cost
+    )
+    stored = {}
+    if constraints is None:
+        stored = await run_in_threadpool(
+            load_stored_paths, src, dst_list, num_best_path, version
+        )
+    missing = [dst_node for dst_node in dst_list if dst_node not in stored]
+    paths = merge(
+        *stored.values(),
+        iter_k_shortest_path(
+            G, src, missing, num_best_path, search=search, constraints=constraints
+        ),
+        key=itemgetter("cost")
+    )
+
+    async def lines():
+        computed = {dst_node: [] for dst_node in missing}
+        while not await request.is_disconnected():
+            item = await run_in_threadpool(next, paths, None)
+            if item is None:
+                # Only complete unconstrained results are worth storing
+                if constraints is None:
+                    await run_in_threadpool(
+                        save_stored_paths, src, computed, num_best_path, version
+                    )
+                return
+            if item["dst"] in computed:
+                computed[item["dst"]].append(item)
+            yield json.dumps(item) + "\n"
 
-    return k_shortest_path(G, src, dst_list, num_best_path)
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 @app.get("/combined/paths")
-def get_combined_best_path(
+async def get_combined_best_path(
     src: DeviceNameRequired,
     dst: ListDeviceNameRequired,
-    num_best_path: int=5
+    num_best_path: int=5,
+    algorithm: Algorithm = "yen",
 ):
 
     if not src:
@@ -261,32 +896,203 @@ def get_combined_best_path(
     if not dst:
         raise HTTPException(status_code=404, detail="dst device is required")
     
-    G = create_graph_from_database_data()
-
-    if not any(src == vertex[0] for vertex in G.vertices):
+    with stage("combined_paths", "graph_load"):
+        G, version = await run_in_threadpool(graph_cache.snapshot)
+    with stage("combined_paths", "validation"):
+        dst_list = validate_path_query(G, src, dst)
+    if len(dst_list) > MAX_COMBINED_DESTINATIONS:
         raise HTTPException(
-            status_code=404, detail=f"src device: {src} not exist on database"
+            status_code=422,
+            detail=f"At most {MAX_COMBINED_DESTINATIONS} dst devices can be combined"
         )
 
-    dst_list = dst[0].split(",")
+    # The combinations break ties by destination order, so only queries
+    # listing the destinations in the same order are coalesced
+    combined = await combined_paths_flight.run(
+        (src, tuple(dst_list), num_best_path, version, algorithm),
+        lambda: find_combined_paths(G, version, src, dst_list, num_best_path, algorithm)
+    )
+    with stage("combined_paths", "serialization"):
+        return JSONResponse(combined)
 
-    # only allow entering maximum 2 destinations
-    if (len(dst_list) > 2):
-        raise HTTPException(
-            status_code=404, detail=f"please enter maximum 2 destinations only"
+
+async def find_combined_paths(
+        G: Graph,
+        version: int,
+        src: str,
+        dst_list: list[str],
+        num_best_path: int,
+        algorithm: str
+) -> list[dict]:
+    with stage("combined_paths", "search"):
+        result, stats = await compute.run_routing(
+            G, version, k_shortest_path_with_stats, src, dst_list,
+            num_best_path, algorithm
+        )
+    metrics.record_search("combined_paths", stats)
+    with stage("combined_paths", "combination"):
+        return await compute.run_routing(
+            G, version, multilple_dest_path, result, num_best_path
         )
-    
-    # remove spaces
-    for i in range(len(dst_list)):
-        dst_list[i] = dst_list[i].strip()
 
-    for dst_node in dst_list:
-        if not any(dst_node == vertex[0] for vertex in G.vertices):
-            raise HTTPException(
-                status_code=404, detail=f"dst device {dst} not exist on database"
+
+@app.get("/multicast/paths")
+async def get_multicast_path(
+    src: DeviceNameRequired,
+    dst: ListDeviceNameRequired,
+):
+    if not src:
+        raise HTTPException(status_code=404, detail="src device is required")
+    if not dst:
+        raise HTTPException(status_code=404, detail="dst device is required")
+
+    G, version = await run_in_threadpool(graph_cache.snapshot)
+    dst_list = validate_path_query(G, src, dst)
+
+    return await compute.run_routing(G, version, multicast_tree, src, dst_list)
+
+
+@app.get("/disjoint/paths")
+async def get_disjoint_paths(
+    src: DeviceNameRequired,
+    dst: DeviceNameRequired,
+    num_paths: Annotated[int, Query(ge=1)] = 2,
+    disjoint: Annotated[Literal["edge", "node"], Query()] = "edge",
+):
+    G, version = await run_in_threadpool(graph_cache.snapshot)
+    dst_list = validate_path_query(G, src, [dst])
+    if len(dst_list) != 1:
+        raise HTTPException(status_code=422, detail="Exactly one dst device is required")
+    dst = dst_list[0]
+    if src == dst:
+        raise HTTPException(status_code=422, detail="src and dst must be different")
+
+    return await compute.run_routing(
+        G, version, disjoint_paths, src, dst, num_paths, disjoint
+    )
+
+
+def load_terminal_devices() -> tuple[list[str], list[str]]:
+    with Session() as session:
+        rows = session.execute(
+            select(Devices.name, Devices.isSource, Devices.isDest)
+            .where(Devices.status == 0, or_(Devices.isSource, Devices.isDest))
+            .order_by(Devices.name)
+        ).all()
+    return (
+        [row.name for row in rows if row.isSource],
+        [row.name for row in rows if row.isDest]
+    )
+
+
+async def find_cost_matrix(
+        G: Graph,
+        version: int,
+        sources: list[str],
+        destinations: list[str]
+) -> dict:
+    with stage("cost_matrix", "search"):
+        matrix = await compute.run_routing(
+            G, version, cost_matrix, sources, destinations
+        )
+    metrics.SEARCH_EXPANSIONS.inc(matrix["expanded"], endpoint="cost_matrix")
+    return matrix
+
+
+def cost_matrix_npz(matrix: dict, version: int, next_hops: bool) -> bytes:
+    # Unreachable pairs cost -1 and have an empty next hop
+    shape = (len(matrix["sources"]), len(matrix["destinations"]))
+    arrays = {
+        "version": np.array(version),
+        "sources": np.array(matrix["sources"], dtype=str),
+        "destinations": np.array(matrix["destinations"], dtype=str),
+        "costs": np.array([
+            -1 if cost is None else cost for row in matrix["costs"] for cost in row
+        ], dtype=np.int64).reshape(shape),
+    }
+    if next_hops:
+        arrays["next_hops"] = np.array([
+            hop or "" for row in matrix["next_hops"] for hop in row
+        ], dtype=str).reshape(shape)
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+@app.get("/cost/matrix")
+async def get_cost_matrix(
+        next_hops: bool = False,
+        format: Annotated[Literal["json", "npz"], Query()] = "json",
+):
+    # Cheapest path cost from every source to every destination device in
+    # service, computed once per graph version
+    with stage("cost_matrix", "graph_load"):
+        G, version = await run_in_threadpool(graph_cache.snapshot)
+        sources, destinations = await run_in_threadpool(load_terminal_devices)
+    sources = [name for name in sources if name in G]
+    destinations = [name for name in destinations if name in G]
+    key = (version, tuple(sources), tuple(destinations))
+    matrix = cost_matrices.get(key)
+    if matrix is None:
+        matrix = await cost_matrix_flight.run(
+            key, lambda: find_cost_matrix(G, version, sources, destinations)
+        )
+        for stale in [other for other in cost_matrices if other[0] != version]:
+            del cost_matrices[stale]
+        cost_matrices[key] = matrix
+
+    with stage("cost_matrix", "serialization"):
+        if format == "npz":
+            return Response(
+                await run_in_threadpool(cost_matrix_npz, matrix, version, next_hops),
+                media_type="application/octet-stream",
+                headers={
+                    "Content-Disposition":
+                        f'attachment; filename="cost_matrix_v{version}.npz"'
+                }
             )
-        
-    result_of_k = k_shortest_path(G, src, dst_list, num_best_path)
-    output = multilple_dest_path (G,result_of_k, num_best_path)
+        result = {
+            "version": version,
+            "sources": matrix["sources"],
+            "destinations": matrix["destinations"],
+            "costs": matrix["costs"],
+        }
+        if next_hops:
+            result["next_hops"] = matrix["next_hops"]
+        return JSONResponse(result)
+
+
+@app.post("/batch/paths/")
+async def get_batch_best_paths(
+    queries: list[PathQuery],
+) -> dict:
+    start = time.perf_counter()
+    G, version = await run_in_threadpool(graph_cache.snapshot)
+    loaded = time.perf_counter()
+
+    # Invalid queries are reported individually instead of failing the batch
+    results = []
+    valid = []
+    for query in queries:
+        result = query.model_dump()
+        missing = [name for name in [query.src, *query.dst] if name not in G]
+        if missing:
+            result["error"] = f"device {', '.join(missing)} not exist on database"
+        else:
+            valid.append((result, (query.src, query.dst, query.num_best_path)))
+        results.append(result)
+
+    computed = await compute.run_routing(
+        G, version, batch_k_shortest_path, [query for _, query in valid]
+    )
+    for (result, _), paths in zip(valid, computed):
+        result["paths"] = paths
+    end = time.perf_counter()
 
-    return output
\ No newline at end of file
+    return {
+        "results": results,
+        "sources": len({query[0] for _, query in valid}),
+        "graph_load_ms": (loaded - start) * 1000,
+        "search_ms": (end - loaded) * 1000,
+        "elapsed_ms": (end - start) * 1000,
+    }
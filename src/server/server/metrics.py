@@ -0,0 +1,146 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Minimal in-process metrics rendered in the Prometheus text exposition
+# format. Values live in the API process, routing workers report their
+# counters back through the stats dicts they return.
+
+_registry = []
+
+
+class Counter:
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter"
+        ]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: tuple = (),
+            buckets: tuple = (
+                    .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10
+            )
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [per bucket counts (the last one is +Inf), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels[name] for name in self.labelnames)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [[0] * (len(self.buckets) + 1), 0]
+            counts[0][i] += 1
+            counts[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram"
+        ]
+        names = self.labelnames + ("le",)
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += n
+                    lines.append(
+                        f"{self.name}_bucket{_labels(names, key + (bound,))} {cumulative}"
+                    )
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def render() -> str:
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+STAGE_SECONDS = Histogram(
+    "routing_stage_seconds",
+    "Time spent per stage of a path query",
+    ("endpoint", "stage")
+)
+SEARCH_EXPANSIONS = Counter(
+    "routing_search_expansions_total",
+    "Nodes settled by path searches",
+    ("endpoint",)
+)
+SEARCH_QUEUED = Counter(
+    "routing_search_queued_total",
+    "Entries pushed onto path search priority queues",
+    ("endpoint",)
+)
+CANDIDATE_QUEUE = Histogram(
+    "routing_candidate_queue_size",
+    "Largest candidate queue of the K shortest path searches of a query",
+    ("endpoint",),
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+)
+COALESCED_REQUESTS = Counter(
+    "routing_coalesced_requests_total",
+    "Path queries answered by an identical query already in flight",
+    ("endpoint",)
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_seconds",
+    "Database statement execution time",
+    ("operation",)
+)
+
+
+def record_search(endpoint: str, stats: dict) -> None:
+    SEARCH_EXPANSIONS.inc(stats.get("expanded", 0), endpoint=endpoint)
+    SEARCH_QUEUED.inc(stats.get("queued", 0), endpoint=endpoint)
+    CANDIDATE_QUEUE.observe(stats.get("candidates", 0), endpoint=endpoint)
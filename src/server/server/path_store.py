@@ -0,0 +1,218 @@
+from sqlalchemy import and_, delete, func, insert, or_, select, update
+from sqlalchemy.orm import Session
+
+from schema import BestPaths, ComponentPaths, Connections, GraphVersion
+
+
+# Materialised K best paths stored in the bestpaths/componentpaths tables.
+# Rows are keyed by (src, dst, num_best_path, version) where version is the
+# graph version of the graphversion table the paths were computed on.
+
+def current_version(session: Session) -> int:
+    version = session.scalar(select(GraphVersion.version).where(GraphVersion.id == 1))
+    return 0 if version is None else version
+
+
+def bump_version(session: Session) -> tuple[int, int]:
+    # (old, new) version. Call it first in every transaction writing devices
+    # or connections, the update holds the version row until the transaction
+    # ends and stored paths are only saved under it.
+    updated = session.execute(
+        update(GraphVersion)
+        .where(GraphVersion.id == 1)
+        .values(version=GraphVersion.version + 1)
+    ).rowcount
+    if updated == 0:
+        session.execute(insert(GraphVersion).values(id=1, version=1))
+    version = current_version(session)
+    return version - 1, version
+
+
+def _lock_version(session: Session) -> int:
+    # Same lock as bump_version, without changing the version
+    session.execute(
+        update(GraphVersion)
+        .where(GraphVersion.id == 1)
+        .values(version=GraphVersion.version)
+    )
+    return current_version(session)
+
+
+def load_best_paths(
+        session: Session,
+        src: str,
+        dst: str,
+        K: int,
+        version: int
+) -> list[dict] | None:
+    rows = session.execute(
+        select(BestPaths.id, BestPaths.cost, Connections.dst)
+        .join(ComponentPaths, ComponentPaths.pathID == BestPaths.id)
+        .join(Connections, Connections.id == ComponentPaths.connID)
+        .where(
+            BestPaths.src == src,
+            BestPaths.dst == dst,
+            BestPaths.num_best_path == K,
+            BestPaths.version == version
+        )
+        .order_by(BestPaths.rank, ComponentPaths.position)
+    ).all()
+    if len(rows) == 0:
+        return None
+    paths = {}
+    for path_id, cost, node in rows:
+        if path_id not in paths:
+            paths[path_id] = {"path": [src], "cost": cost, "dst": dst}
+        paths[path_id]["path"].append(node)
+    return list(paths.values())
+
+
+def save_best_paths(
+        session: Session,
+        src: str,
+        dst: str,
+        K: int,
+        version: int,
+        paths: list[dict]
+) -> None:
+    # Only saved while `version` is current. A write bumps the version before
+    # its invalidation and carries the surviving rows over to the new version
+    # when it commits, rows saved in between would skip the invalidation.
+    if _lock_version(session) != version:
+        return
+    _delete_paths(session, BestPaths.id.in_(
+        select(BestPaths.id).where(
+            BestPaths.src == src,
+            BestPaths.dst == dst,
+            BestPaths.num_best_path == K
+        )
+    ))
+    if src == dst or len(paths) == 0:
+        return
+    nodes = {node for path in paths for node in path["path"]}
+    conn_ids = {
+        (con_src, con_dst): con_id for con_id, con_src, con_dst in session.execute(
+            select(Connections.id, Connections.src, Connections.dst)
+            .where(Connections.src.in_(nodes))
+        )
+    }
+    edges = [list(zip(path["path"], path["path"][1:])) for path in paths]
+    if any(edge not in conn_ids for path_edges in edges for edge in path_edges):
+        # A connection was removed since the graph snapshot was taken
+        return
+    for rank, path in enumerate(paths):
+        session.add(BestPaths(
+            src=src,
+            dst=dst,
+            num_best_path=K,
+            rank=rank,
+            cost=path["cost"],
+            version=version,
+            components=[
+                ComponentPaths(connID=conn_ids[edge], position=position)
+                for position, edge in enumerate(edges[rank])
+            ]
+        ))
+
+
+def stored_results(session: Session, version: int) -> list:
+    # (src, dst, num_best_path, highest cost, number of paths) per stored result
+    return session.execute(
+        select(
+            BestPaths.src,
+            BestPaths.dst,
+            BestPaths.num_best_path,
+            func.max(BestPaths.cost),
+            func.count(BestPaths.id)
+        )
+        .where(BestPaths.version == version)
+        .group_by(BestPaths.src, BestPaths.dst, BestPaths.num_best_path)
+    ).all()
+
+
+def delete_result(session: Session, src: str, dst: str, K: int) -> None:
+    _delete_paths(session, and_(
+        BestPaths.src == src,
+        BestPaths.dst == dst,
+        BestPaths.num_best_path == K
+    ))
+
+
+def invalidate_device(session: Session, name: str) -> None:
+    invalidate_devices(session, [name])
+
+
+def invalidate_devices(session: Session, names: list[str]) -> None:
+    # Stored paths starting, ending or passing through the devices
+    for start in range(0, len(names), 500):
+        batch = names[start:start + 500]
+        through_device = (
+            select(ComponentPaths.pathID)
+            .join(Connections, Connections.id == ComponentPaths.connID)
+            .where(or_(Connections.src.in_(batch), Connections.dst.in_(batch)))
+        )
+        _delete_paths(session, or_(
+            BestPaths.src.in_(batch),
+            BestPaths.dst.in_(batch),
+            BestPaths.id.in_(through_device)
+        ))
+
+
+def invalidate_connection(session: Session, src: str, dst: str) -> None:
+    through_connection = (
+        select(ComponentPaths.pathID)
+        .join(Connections, Connections.id == ComponentPaths.connID)
+        .where(Connections.src == src, Connections.dst == dst)
+    )
+    _delete_paths(session, BestPaths.id.in_(through_connection))
+
+
+def invalidate_connections(session: Session, ids: list[int]) -> None:
+    for start in range(0, len(ids), 1000):
+        through_connection = select(ComponentPaths.pathID).where(
+            ComponentPaths.connID.in_(ids[start:start + 1000])
+        )
+        _delete_paths(session, BestPaths.id.in_(through_connection))
+
+
+def restamp(session: Session, old_version: int, new_version: int) -> None:
+    # Paths that survived a targeted invalidation stay valid on the new graph,
+    # rows of any other version are from searches on older graphs
+    session.execute(
+        update(BestPaths)
+        .where(BestPaths.version == old_version)
+        .values(version=new_version)
+    )
+    _delete_paths(session, BestPaths.version != new_version)
+
+
+def clear(session: Session) -> None:
+    session.execute(delete(ComponentPaths))
+    session.execute(delete(BestPaths))
+
+
+def _delete_paths(session: Session, condition) -> None:
+    # A stored result is only complete with all of its K paths, so every path
+    # sharing (src, dst, num_best_path) with a matching path goes too. Ids are
+    # resolved first since the condition may go through the components being
+    # removed, and components are deleted explicitly rather than relying on
+    # the cascade so the behaviour is the same on every backend.
+    keys = session.execute(
+        select(BestPaths.src, BestPaths.dst, BestPaths.num_best_path)
+        .where(condition)
+        .distinct()
+    ).all()
+    path_ids = []
+    for start in range(0, len(keys), 300):
+        path_ids.extend(session.scalars(select(BestPaths.id).where(or_(*(
+            and_(
+                BestPaths.src == src,
+                BestPaths.dst == dst,
+                BestPaths.num_best_path == K
+            )
+            for src, dst, K in keys[start:start + 300]
+        )))))
+    for start in range(0, len(path_ids), 1000):
+        batch = path_ids[start:start + 1000]
+        session.execute(delete(ComponentPaths).where(ComponentPaths.pathID.in_(batch)))
+        session.execute(delete(BestPaths).where(BestPaths.id.in_(batch)))
@@ -0,0 +1,140 @@
+import time
+from array import array
+from typing import Callable
+
+from routing import INF, Graph
+
+# Ancestor bitsets above this size are not kept, the index then answers
+# every query with "maybe reachable"
+MAX_BYTES = 32 * 1024 * 1024
+
+
+# Reachability index: strongly connected components of the devices in
+# service, numbered so every connection goes to a component with a lower or
+# equal number, and for each component the set of components that can reach
+# it as an integer bitset. v can reach t iff bit comp[v] of the bitset of
+# comp[t] is set.
+class ReachabilityIndex:
+
+    def __init__(self, G: Graph) -> None:
+        start = time.perf_counter()
+        self._comp, self.num_components = _components(G)
+        self._ancestors = _ancestors(G, self._comp, self.num_components)
+        self.build_seconds = time.perf_counter() - start
+
+    def reaches(self, u: int, v: int) -> bool:
+        if self._ancestors is None:
+            return True
+        cu, cv = self._comp[u], self._comp[v]
+        return cu >= 0 and cv >= 0 and self._ancestors[cv] >> cu & 1 == 1
+
+    def heuristic(self, target: int, lower_bound: Callable[[int], float] | None = None):
+        # Wraps an A* lower bound (0 without one) so it is INF on the devices
+        # that cannot reach target, which the search then never queues.
+        # Returned as is when there is nothing to prune.
+        if self._ancestors is None or self._comp[target] < 0:
+            return lower_bound
+        ancestors = self._ancestors[self._comp[target]]
+        if ancestors.bit_count() == self.num_components:
+            return lower_bound
+        comp = self._comp
+        mask = ancestors.to_bytes((self.num_components + 7) // 8, "little")
+
+        def pruned(v: int) -> float:
+            c = comp[v]
+            if c < 0 or not mask[c >> 3] >> (c & 7) & 1:
+                return INF
+            return lower_bound(v) if lower_bound is not None else 0
+
+        return pruned
+
+    def memory_usage(self) -> int:
+        bitsets = sum(
+            (a.bit_length() + 7) // 8 for a in self._ancestors
+        ) if self._ancestors is not None else 0
+        return self._comp.itemsize * len(self._comp) + bitsets
+
+    def status(self) -> dict:
+        return {
+            "components": self.num_components,
+            "bitsets": self._ancestors is not None,
+            "build_ms": self.build_seconds * 1000,
+            "bytes": self.memory_usage(),
+        }
+
+
+def _components(G: Graph) -> tuple[array, int]:
+    # Iterative Tarjan over the devices in service. Components are numbered
+    # in the order they complete, so successors come first. Devices out of
+    # service get -1.
+    offsets, targets, disabled = G._offsets, G._targets, G._disabled
+    n = len(G)
+    index = array("l", [-1]) * n
+    low = array("l", [0]) * n
+    comp = array("l", [-1]) * n
+    on_stack = bytearray(n)
+    stack = []
+    counter = num = 0
+    for root in range(n):
+        if disabled[root] or index[root] != -1:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = 1
+        work = [(root, offsets[root])]
+        while work:
+            u, i = work[-1]
+            end = offsets[u + 1]
+            while i < end:
+                v = targets[i]
+                i += 1
+                if disabled[v]:
+                    continue
+                if index[v] == -1:
+                    # Descend, u resumes after this connection
+                    work[-1] = (u, i)
+                    index[v] = low[v] = counter
+                    counter += 1
+                    stack.append(v)
+                    on_stack[v] = 1
+                    work.append((v, offsets[v]))
+                    break
+                if on_stack[v] and index[v] < low[u]:
+                    low[u] = index[v]
+            else:
+                work.pop()
+                if work and low[u] < low[work[-1][0]]:
+                    low[work[-1][0]] = low[u]
+                if low[u] == index[u]:
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = 0
+                        comp[w] = num
+                        if w == u:
+                            break
+                    num += 1
+    return comp, num
+
+
+def _ancestors(G: Graph, comp: array, num: int) -> list[int] | None:
+    # Components in topological order are the numbers counting down, every
+    # predecessor of a component is final before the component is reached
+    members = [[] for _ in range(num)]
+    for u, c in enumerate(comp):
+        if c >= 0:
+            members[c].append(u)
+    offsets, targets = G._offsets, G._targets
+    ancestors = [1 << c for c in range(num)]
+    size = 0
+    for c in range(num - 1, -1, -1):
+        bits = ancestors[c]
+        size += (bits.bit_length() + 7) // 8
+        if size > MAX_BYTES:
+            return None
+        for u in members[c]:
+            for i in range(offsets[u], offsets[u + 1]):
+                d = comp[targets[i]]
+                if d >= 0 and d != c:
+                    ancestors[d] |= bits
+    return ancestors
@@ -1,7 +1,31 @@
-from typing import List, Tuple
-from itertools import product
+import copy
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from heapq import heappop, heappush, heapreplace, merge, nsmallest
+from itertools import count
+from operator import itemgetter
+from typing import Callable, List, NamedTuple, Tuple
 
 INF = 1e99
+# Shortest path trees kept per graph snapshot, least recently used first out
+MAX_TREES = 64
+# Segment combinations a waypoint search evaluates before it gives up on
+# finding more simple paths
+MAX_WAYPOINT_COMBINATIONS = 1000
+# Search strategies of the Yen searches, see iter_k_shortest_path
+SEARCHES = ("auto", "forward", "bidirectional")
+
+
+class Constraints(NamedTuple):
+    # Path constraints enforced inside the searches, by device name
+    avoid_devices: frozenset = frozenset()
+    avoid_connections: frozenset = frozenset()
+    # Devices every path has to pass through, in this order
+    waypoints: tuple = ()
+    max_hops: int | None = None
+    max_cost: float | None = None
 
 
 class Graph:
@@ -11,43 +35,600 @@ class Graph:
             vertices: List[Tuple[str, int]],
             edges: List[Tuple[str, str, int]]
     ) -> None:
-        self.vertices = vertices
-        self._edges = edges
-        self._connections = {}
+        # Intern device names to integer ids once, the search runs on ids
+        self._index = {}
+        self._names = []
+        device_cost = []
+        for (name, cost) in vertices:
+            if name not in self._index:
+                self._index[name] = len(self._names)
+                self._names.append(name)
+                device_cost.append(cost)
+        self._device_cost = array("q", device_cost)
+
+        # Set relationship as CSR: the neighbours of node u are
+        # _targets[_offsets[u]:_offsets[u + 1]] with matching _weights
+        adjacency = [{} for _ in self._names]
+        reverse_adjacency = [{} for _ in self._names]
+        for (src, dst, cost) in edges:
+            assert src in self._index, f"src node: {src} must be defined"
+            assert dst in self._index, f"dst node: {dst} must be defined"
+            u, v = self._index[src], self._index[dst]
+            if v not in adjacency[u]:
+                adjacency[u][v] = cost
+                reverse_adjacency[v][u] = cost
+        self._offsets, self._targets, self._weights = _to_csr(adjacency)
+        # Same layout over incoming connections: the predecessors of node v
+        self._rev_offsets, self._rev_sources, self._rev_weights = _to_csr(reverse_adjacency)
+
+        # Devices taken out of service after the graph was built stay in the
+        # arrays but are skipped by every search
+        self._disabled = bytearray(len(self._names))
+
+        # Optional landmark distance and reachability indexes, set by the
+        # owner of the graph
+        self.landmarks = None
+        self.reachability = None
+        # Shortest path trees (dist, parent) per source id, see
+        # shortest_path_tree. Kept up to date by the dynamic layer.
+        self.trees = OrderedDict()
+        self._trees_lock = threading.Lock()
 
-        # Set relationship
-        for (src, dst, cost) in self._edges:
-            if src not in self._connections:
-                self._connections[src] = {}
-            if dst not in self._connections[src]:
-                self._connections[src][dst] = cost
+    @classmethod
+    def from_arrays(
+            cls,
+            names: list[str],
+            _device_cost,
+            _disabled,
+            _offsets,
+            _targets,
+            _weights,
+            _rev_offsets,
+            _rev_sources,
+            _rev_weights
+    ) -> "Graph":
+        # Graph over ready made CSR arrays, e.g. views into a snapshot file
+        G = cls.__new__(cls)
+        G._names = names
+        G._index = {name: u for u, name in enumerate(names)}
+        G._device_cost, G._disabled = _device_cost, _disabled
+        G._offsets, G._targets, G._weights = _offsets, _targets, _weights
+        G._rev_offsets, G._rev_sources, G._rev_weights = _rev_offsets, _rev_sources, _rev_weights
+        G.landmarks = None
+        G.reachability = None
+        G.trees = OrderedDict()
+        G._trees_lock = threading.Lock()
+        return G
+
+    def __getstate__(self):
+        # Trees are rebuilt on demand rather than shipped to other processes,
+        # arrays mapped from a snapshot file are shipped as copies
+        state = self.__dict__.copy()
+        del state["trees"], state["_trees_lock"]
+        state.pop("_mapping", None)
+        for key, value in state.items():
+            if isinstance(value, memoryview):
+                state[key] = bytearray(value) if key == "_disabled" else array(value.format, value)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.trees = OrderedDict()
+        self._trees_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._index and not self._disabled[self._index[name]]
 
     def __getitem__(self, item: str | Tuple[str, str]):
         if isinstance(item, str):
-            return self._connections.get(item, None)
+            u = self._index.get(item, None)
+            if u is None or self._offsets[u] == self._offsets[u + 1]:
+                return None
+            return {
+                self._names[v]: w for v, w in self.successors(u)
+                if not self._disabled[v]
+            }
         if isinstance(item, tuple):
             assert len(item) == 2, "item must be (src, dst)"
-            assert any(item[0] == vertex[0] for vertex in self.vertices), f"src node: {item[0]} must be defined"
-            assert any(item[1] == vertex[0] for vertex in self.vertices), f"src node: {item[1]} must be defined"
-            
-            # assert item[0] in self.vertices, f"src node: {item[0]} must be defined"
-            # assert item[1] in self.vertices, f"dst node: {item[1]} must be defined"
-            key_dict = self._connections.get(item[0], None)
-            if key_dict is not None:
-                return key_dict.get(item[1], INF)
-            return None
+            assert item[0] in self, f"src node: {item[0]} must be defined"
+            assert item[1] in self, f"dst node: {item[1]} must be defined"
+            u = self._index[item[0]]
+            if self._offsets[u] == self._offsets[u + 1]:
+                return None
+            return self.edge_cost(u, self._index[item[1]])
+
+    @property
+    def vertices(self) -> List[Tuple[str, int]]:
+        return [
+            (name, self._device_cost[u]) for u, name in enumerate(self._names)
+            if not self._disabled[u]
+        ]
+
+    def topology(self):
+        edges = {
+            (self._names[u], self._names[v], w)
+            for u in range(len(self._names)) if not self._disabled[u]
+            for v, w in self.successors(u) if not self._disabled[v]
+        }
+        return set(self.vertices), edges
+
+    def copy(self) -> "Graph":
+        # Copy on write snapshot: the mutable arrays are copied, names, ids
+        # and the adjacency structure are shared
+        G = copy.copy(self)
+        G._device_cost = array("q", self._device_cost)
+        G._weights = array("q", self._weights)
+        G._rev_weights = array("q", self._rev_weights)
+        G._disabled = bytearray(self._disabled)
+        G.trees = OrderedDict()
+        G._trees_lock = threading.Lock()
+        return G
+
+    def shortest_path_tree(self, src: int, stats: dict | None = None):
+        with self._trees_lock:
+            tree = self.trees.get(src)
+            if tree is not None:
+                self.trees.move_to_end(src)
+                return tree
+        tree = _dijkstra(self, src, stats=stats)
+        with self._trees_lock:
+            self.trees[src] = tree
+            if len(self.trees) > MAX_TREES:
+                self.trees.popitem(last=False)
+        return tree
+
+    def reachable(self, src: str, dst: str) -> bool:
+        # False only when the reachability index rules out every path
+        if self.reachability is None:
+            return True
+        return self.reachability.reaches(self._index[src], self._index[dst])
+
+    def node_id(self, name: str) -> int:
+        return self._index[name]
+
+    def node_name(self, node: int) -> str:
+        return self._names[node]
+
+    def successors(self, node: int):
+        start, end = self._offsets[node], self._offsets[node + 1]
+        return zip(self._targets[start:end], self._weights[start:end])
+
+    def edge_cost(self, u: int, v: int) -> int:
+        for target, w in self.successors(u):
+            if target == v:
+                return w
+        return INF
+
+    def predecessors(self, node: int):
+        start, end = self._rev_offsets[node], self._rev_offsets[node + 1]
+        return zip(self._rev_sources[start:end], self._rev_weights[start:end])
 
     def neighbour(self, node: str):
         if self[node]:
             return list(self[node].keys())
         return []
-    
-    def get_device_cost(self,device_name:str)->int:
-        cost = [v[1] for v in self.vertices if v[0] == device_name]
-        return cost[0]
 
+    def get_device_cost(self, device_name: str) -> int:
+        return self._device_cost[self._index[device_name]]
+
+    def memory_usage(self) -> dict:
+        arrays = (
+            self._offsets, self._targets, self._weights, self._device_cost,
+            self._rev_offsets, self._rev_sources, self._rev_weights
+        )
+        total = sum(a.itemsize * len(a) for a in arrays)
+        num_edges = len(self._targets)
+        return {
+            "vertices": len(self._names),
+            "edges": num_edges,
+            "bytes": total,
+            "bytes_per_edge": total / num_edges if num_edges else 0,
+        }
+
+
+def _to_csr(adjacency: list[dict]):
+    offsets = array("l", [0])
+    targets = array("l")
+    weights = array("q")
+    for neighbours in adjacency:
+        targets.extend(neighbours.keys())
+        weights.extend(neighbours.values())
+        offsets.append(len(targets))
+    return offsets, targets, weights
+
+
+def _dijkstra(
+        G: Graph,
+        src: int,
+        dst: int = -1,
+        banned_nodes: set | frozenset = frozenset(),
+        banned_edges: set | frozenset = frozenset(),
+        heuristic: Callable[[int], float] | None = None,
+        limit: float = INF,
+        stats: dict | None = None,
+        until: set | None = None
+):
+    # Distances include the device cost of every node after src. Parent
+    # pointers share path prefixes, paths are only materialised on demand.
+    # With a heuristic (an admissible lower bound on the distance to dst)
+    # this is A*. Nodes that cannot reach dst within `limit` are not
+    # expanded, dst is left out of the result if it was not settled. The
+    # search also ends once every node of `until` is settled, the set is
+    # consumed.
+    offsets, targets, weights = G._offsets, G._targets, G._weights
+    device_cost, disabled = G._device_cost, G._disabled
+    dist = {src: 0}
+    parent = {src: -1}
+    done = set()
+    heap = [(heuristic(src) if heuristic else 0, src)]
+    queued = 1
+    while heap:
+        f, u = heappop(heap)
+        if u in done:
+            continue
+        if f > limit:
+            break
+        done.add(u)
+        if u == dst:
+            break
+        if until is not None:
+            until.discard(u)
+            if not until:
+                break
+        d = dist[u]
+        for i in range(offsets[u], offsets[u + 1]):
+            v = targets[i]
+            if disabled[v] or v in banned_nodes or (u, v) in banned_edges:
+                continue
+            nd = d + weights[i] + device_cost[v]
+            if nd < dist.get(v, INF):
+                h = heuristic(v) if heuristic else 0
+                if h >= INF:
+                    continue
+                dist[v] = nd
+                parent[v] = u
+                heappush(heap, (nd + h, v))
+                queued += 1
+    if dst != -1 and dst not in done:
+        dist.pop(dst, None)
+    if stats is not None:
+        stats["expanded"] = stats.get("expanded", 0) + len(done)
+        stats["queued"] = stats.get("queued", 0) + queued
+    return dist, parent
+
+
+def _bidirectional_dijkstra(
+        G: Graph,
+        src: int,
+        dst: int,
+        banned_nodes: set | frozenset = frozenset(),
+        banned_edges: set | frozenset = frozenset(),
+        limit: float = INF,
+        stats: dict | None = None
+):
+    # Forward search from src over the successors and backward search from
+    # dst over the predecessors, meeting in the middle. Both use the edge
+    # weight w(u, v) + c(v), so a path through (u, v) costs
+    # df[u] + w(u, v) + c(v) + db[v] and the cost includes the dst device
+    # cost like _dijkstra. Returns (path, cost), or None when dst cannot be
+    # reached within `limit`.
+    if src == dst:
+        return [src], 0
+    device_cost, disabled = G._device_cost, G._disabled
+    sides = (
+        (G._offsets, G._targets, G._weights, {src: 0}, {src: -1}, [(0, src)], set()),
+        (G._rev_offsets, G._rev_sources, G._rev_weights, {dst: 0}, {dst: -1}, [(0, dst)], set())
+    )
+    best, meet = INF, -1
+    queued = 2
+    while sides[0][5] and sides[1][5]:
+        bound = sides[0][5][0][0] + sides[1][5][0][0]
+        if bound >= best or bound > limit:
+            break
+        # Grow the side with the smaller frontier
+        forward = len(sides[0][5]) <= len(sides[1][5])
+        offsets, adjacent, weights, dist, parent, heap, done = sides[0 if forward else 1]
+        other_dist = sides[1 if forward else 0][3]
+        d, u = heappop(heap)
+        if u in done:
+            continue
+        done.add(u)
+        for i in range(offsets[u], offsets[u + 1]):
+            v = adjacent[i]
+            if disabled[v] or v in banned_nodes:
+                continue
+            if forward:
+                if (u, v) in banned_edges:
+                    continue
+                nd = d + weights[i] + device_cost[v]
+            else:
+                if (v, u) in banned_edges:
+                    continue
+                nd = d + weights[i] + device_cost[u]
+            if nd < dist.get(v, INF):
+                dist[v] = nd
+                parent[v] = u
+                heappush(heap, (nd, v))
+                queued += 1
+                if v in other_dist and nd + other_dist[v] < best:
+                    best, meet = nd + other_dist[v], v
+    if stats is not None:
+        stats["expanded"] = stats.get("expanded", 0) + len(sides[0][6]) + len(sides[1][6])
+        stats["queued"] = stats.get("queued", 0) + queued
+    if meet == -1 or best > limit:
+        return None
+
+    path = _trace_path(sides[0][4], meet)
+    node = sides[1][4][meet]
+    while node != -1:
+        path.append(node)
+        node = sides[1][4][node]
+    # Both halves are shortest, they can only overlap on a zero cost cycle
+    position = {}
+    simple = []
+    for node in path:
+        if node in position:
+            del simple[position[node] + 1:]
+            position = {n: i for i, n in enumerate(simple)}
+        else:
+            position[node] = len(simple)
+            simple.append(node)
+    return simple, best
+
+
+def _hop_limited_dijkstra(
+        G: Graph,
+        src: int,
+        dst: int,
+        max_hops: int,
+        banned_nodes: set | frozenset = frozenset(),
+        banned_edges: set | frozenset = frozenset(),
+        limit: float = INF,
+        stats: dict | None = None
+):
+    # Dijkstra over (node, hops) states for the cheapest path of at most
+    # max_hops connections. States come off the heap in cost order, so a
+    # state is only expanded when it reaches its node with fewer hops than
+    # every cheaper state did before, the rest are dominated. Returns
+    # (path, cost) like _bidirectional_dijkstra.
+    offsets, targets, weights = G._offsets, G._targets, G._weights
+    device_cost, disabled = G._device_cost, G._disabled
+    dist = {(src, 0): 0}
+    parent = {(src, 0): None}
+    fewest_hops = {}
+    heap = [(0, 0, src)]
+    queued = expanded = 0
+    found = None
+    while heap:
+        d, h, u = heappop(heap)
+        if d > limit:
+            break
+        if d > dist[u, h] or h >= fewest_hops.get(u, max_hops + 1):
+            continue
+        fewest_hops[u] = h
+        expanded += 1
+        if u == dst:
+            found = d, h
+            break
+        if h == max_hops:
+            continue
+        for i in range(offsets[u], offsets[u + 1]):
+            v = targets[i]
+            if disabled[v] or v in banned_nodes or (u, v) in banned_edges:
+                continue
+            nd = d + weights[i] + device_cost[v]
+            if h + 1 < fewest_hops.get(v, max_hops + 1) and nd < dist.get((v, h + 1), INF):
+                dist[v, h + 1] = nd
+                parent[v, h + 1] = (u, h)
+                heappush(heap, (nd, h + 1, v))
+                queued += 1
+    if stats is not None:
+        stats["expanded"] = stats.get("expanded", 0) + expanded
+        stats["queued"] = stats.get("queued", 0) + queued + 1
+    if found is None:
+        return None
+    path = []
+    state = (dst, found[1])
+    while state is not None:
+        path.append(state[0])
+        state = parent[state]
+    path.reverse()
+    return path, found[0]
+
+
+def _trace_path(parent: dict, node: int) -> list[int]:
+    path = []
+    while node != -1:
+        path.append(node)
+        node = parent[node]
+    path.reverse()
+    return path
+
+
+def _yen_k_shortest_path(
+        G: Graph,
+        src: int,
+        dst: int,
+        K: int,
+        tree=None,
+        stats: dict | None = None,
+        bidirectional: bool = False,
+        avoid_nodes: set | frozenset = frozenset(),
+        avoid_edges: set | frozenset = frozenset(),
+        max_hops: int | None = None,
+        max_cost: float = INF
+):
+    # Yen's loopless K shortest paths over node ids. `tree` is an optional
+    # (dist, parent) shortest path tree rooted at src, shared across
+    # destinations. Searches use the landmark lower bounds when the graph
+    # has them, or meet in the middle when `bidirectional`, and spur searches
+    # that cannot beat the candidates already queued for the remaining slots
+    # are cut short. Avoided nodes and edges are banned in every search,
+    # max_hops switches to a hop limited search and max_cost caps the limit.
+    # With a reachability index unreachable pairs end right away and the
+    # directed searches skip devices that cannot reach dst.
+    heuristic = G.landmarks.heuristic(dst) if G.landmarks is not None else None
+    if G.reachability is not None:
+        if not G.reachability.reaches(src, dst):
+            return
+        heuristic = G.reachability.heuristic(dst, heuristic)
+    device_cost = G._device_cost
+
+    def search(start, banned_nodes, banned_edges, limit, hops):
+        if avoid_nodes:
+            banned_nodes = banned_nodes | avoid_nodes
+        if avoid_edges:
+            banned_edges = banned_edges | avoid_edges
+        if max_hops is not None:
+            return _hop_limited_dijkstra(
+                G, start, dst, hops, banned_nodes, banned_edges, limit, stats
+            )
+        if bidirectional:
+            return _bidirectional_dijkstra(
+                G, start, dst, banned_nodes, banned_edges, limit, stats
+            )
+        dist, parent = _dijkstra(
+            G, start, dst, banned_nodes, banned_edges, heuristic, limit, stats
+        )
+        return (_trace_path(parent, dst), dist[dst]) if dst in dist else None
+
+    if tree is not None:
+        dist, parent = tree
+        found = (_trace_path(parent, dst), dist[dst]) if dst in dist else None
+    else:
+        found = search(
+            src, frozenset(), frozenset(), max_cost + device_cost[dst], max_hops
+        )
+    if K <= 0 or found is None:
+        return
+    accepted = [found[0]]
+    yield found[0], found[1] - device_cost[dst]
+
+    # Devices that accepted paths continue to after each of their prefixes
+    branches = {}
+
+    def add_branches(path):
+        for i in range(len(path) - 1):
+            branches.setdefault(tuple(path[:i + 1]), set()).add(path[i + 1])
 
-def k_shortest_path(G: Graph, src: str, dst: str | list[str], K: int):
+    add_branches(found[0])
+    candidates = []
+    seen = {tuple(accepted[0])}
+    counter = count()
+    while len(accepted) < K:
+        prev = accepted[-1]
+        root_cost = 0
+        for i in range(len(prev) - 1):
+            spur = prev[i]
+            root = prev[:i + 1]
+            banned_edges = {(spur, v) for v in branches[tuple(root)]}
+            needed = K - len(accepted)
+            limit = nsmallest(needed, candidates)[-1][0] if len(candidates) >= needed else INF
+            limit = min(limit, max_cost)
+            if max_hops is not None and i >= max_hops:
+                break
+            found = search(
+                spur, set(root[:-1]), banned_edges,
+                limit - root_cost + device_cost[dst],
+                None if max_hops is None else max_hops - i
+            )
+            if found is not None:
+                path = root[:-1] + found[0]
+                if tuple(path) not in seen:
+                    seen.add(tuple(path))
+                    cost = root_cost + found[1] - device_cost[dst]
+                    heappush(candidates, (cost, next(counter), path))
+            root_cost += G.edge_cost(prev[i], prev[i + 1]) + device_cost[prev[i + 1]]
+        if stats is not None:
+            stats["candidates"] = max(stats.get("candidates", 0), len(candidates))
+        if not candidates:
+            return
+        cost, _, path = heappop(candidates)
+        accepted.append(path)
+        add_branches(path)
+        yield path, cost
+
+
+def _waypoint_k_shortest_path(
+        G: Graph,
+        src: int,
+        dst: int,
+        K: int,
+        waypoints: list[int],
+        stats: dict | None = None,
+        bidirectional: bool = False,
+        avoid_nodes: set | frozenset = frozenset(),
+        max_hops: int | None = None,
+        max_cost: float = INF,
+        **bounds
+):
+    # Segment decomposition: a path through the waypoints is a sequence of
+    # paths between consecutive stops. The segment paths come lazily from
+    # one Yen generator per segment, each banning the other stops since a
+    # simple path only passes a stop once, and their combinations are
+    # enumerated best first, by exact cost, until K of them form simple
+    # paths within the bounds. Segments may still cross each other away
+    # from the stops, so at most MAX_WAYPOINT_COMBINATIONS combinations are
+    # evaluated. Waypoint device costs are paid on top of the segments.
+    stops = [src, *waypoints, dst]
+    segments = [
+        _yen_k_shortest_path(
+            G, a, b, sys.maxsize, None, stats, bidirectional,
+            avoid_nodes=avoid_nodes | (frozenset(stops) - {a, b}),
+            max_hops=max_hops, max_cost=max_cost, **bounds
+        )
+        for a, b in zip(stops, stops[1:])
+    ]
+    lists = [[] for _ in segments]
+
+    def fetch(i, j):
+        while len(lists[i]) <= j:
+            item = next(segments[i], None)
+            if item is None:
+                return False
+            lists[i].append(item)
+        return True
+
+    if not all(fetch(i, 0) for i in range(len(segments))):
+        return
+    extra = sum(G._device_cost[w] for w in waypoints)
+
+    def combination_cost(index):
+        return sum(lists[i][j][1] for i, j in enumerate(index)) + extra
+
+    start = (0,) * len(segments)
+    frontier = [(combination_cost(start), start)]
+    seen = {start}
+    found = 0
+    for _ in range(MAX_WAYPOINT_COMBINATIONS):
+        if not frontier or found == K:
+            return
+        cost, index = heappop(frontier)
+        if cost > max_cost:
+            return
+        path = list(lists[0][index[0]][0])
+        for i in range(1, len(index)):
+            path.extend(lists[i][index[i]][0][1:])
+        if len(set(path)) == len(path) and (max_hops is None or len(path) <= max_hops + 1):
+            found += 1
+            yield path, cost
+        for i in range(len(index)):
+            neighbour = index[:i] + (index[i] + 1,) + index[i + 1:]
+            if neighbour not in seen and fetch(i, index[i] + 1):
+                seen.add(neighbour)
+                heappush(frontier, (combination_cost(neighbour), neighbour))
+
+
+def _legacy_k_shortest_path(
+        G: Graph,
+        src: str,
+        dst: list[str],
+        K: int,
+        stats: dict | None = None
+):
     result = {dest: [] for dest in dst}
     count = {vertice[0]: 0 for vertice in G.vertices}
     priority_queue = [{"path": [src], "cost": 0, "dst": src}]
@@ -55,6 +636,9 @@ def k_shortest_path(G: Graph, src: str, dst: str | list[str], K: int):
     while len(priority_queue) != 0 and sum([count[dest] for dest in dst]) < K * len(dst):
         priority_queue = sorted(priority_queue, key=lambda x: x['cost'])
         path = priority_queue.pop(0)
+        if stats is not None:
+            stats["expanded"] = stats.get("expanded", 0) + 1
+            stats["candidates"] = max(stats.get("candidates", 0), len(priority_queue) + 1)
         u = path['dst']
         count[u] += 1
         if u in dst:
@@ -67,24 +651,136 @@ def k_shortest_path(G: Graph, src: str, dst: str | list[str], K: int):
                       "dst": v
                       }
                 priority_queue.append(pv)
+                if stats is not None:
+                    stats["queued"] = stats.get("queued", 0) + 1
     return result
 
 
+def k_shortest_path(
+        G: Graph,
+        src: str,
+        dst: str | list[str],
+        K: int,
+        algorithm: str = "yen",
+        stats: dict | None = None,
+        search: str = "auto",
+        constraints: Constraints | None = None
+):
+    if isinstance(dst, str):
+        dst = [dst]
+    if algorithm == "legacy":
+        if constraints is not None and constraints != Constraints():
+            raise ValueError("The legacy algorithm does not support constraints")
+        return _legacy_k_shortest_path(G, src, dst, K, stats)
+    if algorithm != "yen":
+        raise ValueError(f"Unknown algorithm: {algorithm}")
+
+    result = {dest: [] for dest in dst}
+    for item in iter_k_shortest_path(G, src, dst, K, stats, search, constraints):
+        result[item["dst"]].append(item)
+    return result
+
+
+def iter_k_shortest_path(
+        G: Graph,
+        src: str,
+        dst: str | list[str],
+        K: int,
+        stats: dict | None = None,
+        search: str = "auto",
+        constraints: Constraints | None = None
+):
+    # Yen's paths to every dst merged into one stream in cost order, each
+    # path is yielded as soon as it is final. Searches for a dst only run as
+    # far as the stream is consumed.
+    if search not in SEARCHES:
+        raise ValueError(f"Unknown search: {search}")
+    if isinstance(dst, str):
+        dst = [dst]
+    dst = list(dict.fromkeys(dst))
+    if not dst:
+        return
+
+    # One shortest path tree from src gives the first path to every dst,
+    # names are translated to ids only here and back in the result. A
+    # single destination uses a directed (A*) search instead when the graph
+    # has a landmark index. A single shortest path is found meeting in the
+    # middle unless the tree from src is already cached.
+    names = G._names
+    src_id = G.node_id(src)
+    # Destinations the reachability index rules out get no paths and need no
+    # search, not even the shortest path tree
+    dst = [dest for dest in dst if G.reachable(src, dest)]
+    if not dst:
+        return
+    if search == "auto":
+        single = len(dst) == 1 and K == 1 and G.landmarks is None
+        search = "bidirectional" if single and src_id not in G.trees else "forward"
+    bidirectional = search == "bidirectional"
+    if constraints is None:
+        constraints = Constraints()
+    tree = None
+    if constraints == Constraints() and not bidirectional and (
+            len(dst) > 1 or G.landmarks is None
+    ):
+        tree = G.shortest_path_tree(src_id, stats)
+    bounds = {
+        "avoid_nodes": frozenset(G.node_id(name) for name in constraints.avoid_devices),
+        "avoid_edges": frozenset(
+            (G.node_id(u), G.node_id(v)) for u, v in constraints.avoid_connections
+        ),
+        "max_hops": constraints.max_hops,
+        "max_cost": INF if constraints.max_cost is None else constraints.max_cost
+    }
+    waypoints = [G.node_id(name) for name in constraints.waypoints]
+
+    def paths(dest: str):
+        if waypoints:
+            found = _waypoint_k_shortest_path(
+                G, src_id, G.node_id(dest), K, waypoints, stats, bidirectional,
+                **bounds
+            )
+        else:
+            found = _yen_k_shortest_path(
+                G, src_id, G.node_id(dest), K, tree, stats, bidirectional,
+                **bounds
+            )
+        for path, cost in found:
+            yield {"path": [names[u] for u in path], "cost": cost, "dst": dest}
+
+    yield from merge(*(paths(dest) for dest in dst), key=itemgetter("cost"))
+
+
+def k_shortest_path_with_stats(
+        G: Graph,
+        src: str,
+        dst: str | list[str],
+        K: int,
+        algorithm: str = "yen",
+        search: str = "auto",
+        constraints: Constraints | None = None
+):
+    stats = {"expanded": 0}
+    return k_shortest_path(G, src, dst, K, algorithm, stats, search, constraints), stats
+
+
 def find_shared_nodes (subpaths):
+    if len(subpaths) < 2:
+        return []
     set_path = [set(subpath[1:]) for subpath in subpaths]
     shared_nodes = set_path[0].intersection(*set_path[1:])
     output = list (shared_nodes)
     return output
 
 def find_shared_edges (subpaths):
+    # Connections of the first subpath that every other subpath also uses
+    if len(subpaths) < 2:
+        return []
+    edge_sets = [set(zip(subpath, subpath[1:])) for subpath in subpaths[1:]]
     shared_edges = []
-
-    for i in range(len(subpaths[0]) - 1):
-        edge1 = (subpaths[0][i], subpaths[0][i+1])
-        for j in range(len(subpaths[1]) - 1):
-            edge2 = (subpaths[1][j], subpaths[1][j+1])
-            if edge1 == edge2:
-                shared_edges.append(edge1)
+    for edge in zip(subpaths[0], subpaths[0][1:]):
+        if all(edge in edges for edges in edge_sets):
+            shared_edges.append(edge)
     return shared_edges
 
 def cal_nodes_cost (G: Graph, shared_nodes):
@@ -107,29 +803,344 @@ def cal_edges_cost (G: Graph, shared_edges):
         cost += G[shared_edges[i]]
     return cost
 
-def multilple_dest_path (G: Graph, result, K: int):
-    lists = list (result.values())
-    combinations = list (product(*lists))
-    output = []
+def combine_paths (G: Graph, combi):
+    list_of_paths = [item["path"] for item in combi]
+
+    shared_nodes = find_shared_nodes (list_of_paths)
+    shared_edges = find_shared_edges (list_of_paths)
+
+    overall_cost = sum(item["cost"] for item in combi)
+    overall_cost = overall_cost - cal_nodes_cost(G,shared_nodes) - cal_edges_cost(G,shared_edges)
+
+    return {"subpaths": combi, "shared_devices": shared_nodes, "shared_connections": shared_edges, "overall_cost": overall_cost}
+
+def multilple_dest_path (G: Graph, result, K: int, stats: dict | None = None):
+    # Lazy best-first enumeration of the combination lattice. A combination
+    # is a tuple of indices into the per destination path lists, its
+    # neighbours increment one index. The priority of a combination is a
+    # lower bound on the overall cost of it and of every combination above
+    # it in the lattice: their shared discount only counts devices and
+    # connections that are in some path of every remaining list
+    # lists[i][index[i]:], and is at most the full cost (devices and
+    # connections) of the cheapest member path. Both caps shrink as the
+    # indices grow. The search stops once no unexplored combination can beat
+    # the K-th best one evaluated.
+    lists = [sorted(paths, key=lambda x: x["cost"]) for paths in result.values()]
+    if K <= 0 or len(lists) == 0 or any(len(paths) == 0 for paths in lists):
+        return []
+    full_costs = [
+        [item["cost"] + G.get_device_cost(item["dst"]) for item in paths]
+        for paths in lists
+    ]
+    # Last position in each list of the devices (keyed by name) and
+    # connections (keyed by pair) that are in at least one path of every
+    # list, only those can ever be shared
+    last = []
+    for paths in lists:
+        positions = {}
+        for j, item in enumerate(paths):
+            path = item["path"]
+            for element in path[1:] + list(zip(path, path[1:])):
+                positions[element] = j
+        last.append(positions)
+    common = set(last[0]).intersection(*last[1:])
+    shareable = [
+        (G[element] if isinstance(element, tuple) else G.get_device_cost(element),
+         [positions[element] for positions in last])
+        for element in common
+    ]
+
+    def lower_bound(index):
+        total = sum(lists[i][j]["cost"] for i, j in enumerate(index))
+        if len(index) < 2:
+            return total
+        discount = sum(
+            cost for cost, positions in shareable
+            if all(p >= j for p, j in zip(positions, index))
+        )
+        return total - min(discount, min(full_costs[i][j] for i, j in enumerate(index)))
+
+    start = (0,) * len(lists)
+    frontier = [(lower_bound(start), start)]
+    seen = {start}
+    best = []
+    while frontier:
+        bound, index = heappop(frontier)
+        if len(best) == K and bound > -best[0][0]:
+            break
+        part_of_output = combine_paths(G, tuple(lists[i][j] for i, j in enumerate(index)))
+        if stats is not None:
+            stats["combinations"] = stats.get("combinations", 0) + 1
+        # best is a max heap on (overall_cost, index) holding the K best
+        item = (-part_of_output["overall_cost"], tuple(-j for j in index), part_of_output)
+        if len(best) < K:
+            heappush(best, item)
+        elif item[:2] > best[0][:2]:
+            heapreplace(best, item)
+        for i in range(len(index)):
+            if index[i] + 1 < len(lists[i]):
+                neighbour = index[:i] + (index[i] + 1,) + index[i + 1:]
+                if neighbour not in seen:
+                    seen.add(neighbour)
+                    heappush(frontier, (lower_bound(neighbour), neighbour))
+
+    best.sort(key=lambda x: (-x[0], tuple(-j for j in x[1])))
+    return [part_of_output for _, _, part_of_output in best]
+
+def multicast_tree(G: Graph, src: str, dst: list[str]):
+    # Shortest path heuristic for the directed Steiner tree: starting from
+    # src, repeatedly attach the destination closest to the current tree
+    # (multi-source Dijkstra with every tree node at distance 0) along its
+    # shortest path. One search per destination, each growing the tree.
+    offsets, targets, weights = G._offsets, G._targets, G._weights
+    device_cost, disabled = G._device_cost, G._disabled
+    src_id = G.node_id(src)
+    tree = {src_id: -1}
+    remaining = {G.node_id(dest) for dest in dst} - {src_id}
+    while remaining:
+        dist = dict.fromkeys(tree, 0)
+        parent = {}
+        heap = [(0, u) for u in tree]
+        done = set()
+        found = -1
+        while heap:
+            d, u = heappop(heap)
+            if u in done:
+                continue
+            done.add(u)
+            if u in remaining:
+                found = u
+                break
+            for i in range(offsets[u], offsets[u + 1]):
+                v = targets[i]
+                if disabled[v]:
+                    continue
+                nd = d + weights[i] + device_cost[v]
+                if nd < dist.get(v, INF):
+                    dist[v] = nd
+                    parent[v] = u
+                    heappush(heap, (nd, v))
+        if found == -1:
+            break
+        node = found
+        while node not in tree:
+            tree[node] = parent[node]
+            remaining.discard(node)
+            node = parent[node]
+
+    names = G._names
+    subpaths = []
+    unreachable = []
+    for dest in dst:
+        node = G.node_id(dest)
+        if node not in tree:
+            unreachable.append(dest)
+            continue
+        path = _trace_path(tree, node)
+        cost = sum(G.edge_cost(u, v) + device_cost[v] for u, v in zip(path, path[1:]))
+        subpaths.append({
+            "path": [names[u] for u in path],
+            "cost": cost - device_cost[node],
+            "dst": dest,
+        })
+    output = combine_paths(G, tuple(subpaths))
+    output["connections"] = [
+        (names[u], names[v]) for v, u in tree.items() if u != -1
+    ]
+    output["tree_cost"] = sum(
+        G.edge_cost(u, v) + device_cost[v] for v, u in tree.items() if u != -1
+    )
+    output["unreachable"] = unreachable
+    return output
+
+
+def disjoint_paths(G: Graph, src: str, dst: str, K: int, disjoint: str = "edge"):
+    # Minimum total cost set of up to K edge or node disjoint paths, as a
+    # min cost flow solved by successive shortest paths: each round is one
+    # Dijkstra on the residual network with reduced costs (Johnson
+    # potentials keep them non-negative) and pushes one unit of flow, like
+    # Suurballe's algorithm generalised to K paths. Device costs are arc
+    # costs, on the connection into the device for edge disjoint paths and
+    # on an in -> out arc of capacity 1 splitting the device for node
+    # disjoint ones. Connections are unidirectional, so a residual arc never
+    # runs parallel to a real one in the opposite direction.
+    if disjoint not in ("edge", "node"):
+        raise ValueError(f"Unknown disjointness: {disjoint}")
+    device_cost, disabled = G._device_cost, G._disabled
+    s, t = G.node_id(src), G.node_id(dst)
+    n = len(G._names)
+    # Residual network as parallel arc lists, arc a ^ 1 is the reverse of a
+    heads, caps, costs = [], [], []
+    arcs = [[] for _ in range(2 * n if disjoint == "node" else n)]
+
+    def add_arc(u, v, capacity, cost):
+        arcs[u].append(len(heads))
+        heads.append(v)
+        caps.append(capacity)
+        costs.append(cost)
+        arcs[v].append(len(heads))
+        heads.append(u)
+        caps.append(0)
+        costs.append(-cost)
+
+    if disjoint == "node":
+        # Device v is entered at 2v and left at 2v + 1
+        for v in range(n):
+            if not disabled[v]:
+                add_arc(2 * v, 2 * v + 1, K if v in (s, t) else 1, 0 if v == s else device_cost[v])
+        for u in range(n):
+            for v, w in G.successors(u):
+                if not (disabled[u] or disabled[v]):
+                    add_arc(2 * u + 1, 2 * v, 1, w)
+        source, sink = 2 * s, 2 * t + 1
+    else:
+        for u in range(n):
+            for v, w in G.successors(u):
+                if not (disabled[u] or disabled[v]):
+                    add_arc(u, v, 1, w + device_cost[v])
+        source, sink = s, t
 
-    for combi in combinations:
-        list_of_paths = [item["path"] for item in combi]
+    potential = [0] * len(arcs)
+    flow = 0
+    while flow < K:
+        dist = {source: 0}
+        parent_arc = {}
+        done = set()
+        heap = [(0, source)]
+        while heap:
+            d, u = heappop(heap)
+            if u in done:
+                continue
+            done.add(u)
+            if u == sink:
+                break
+            for a in arcs[u]:
+                if caps[a] == 0:
+                    continue
+                v = heads[a]
+                nd = d + costs[a] + potential[u] - potential[v]
+                if nd < dist.get(v, INF):
+                    dist[v] = nd
+                    parent_arc[v] = a
+                    heappush(heap, (nd, v))
+        if sink not in done:
+            break
+        for v in done:
+            potential[v] += dist[v] - dist[sink]
+        v = sink
+        while v != source:
+            a = parent_arc[v]
+            caps[a] -= 1
+            caps[a ^ 1] += 1
+            v = heads[a ^ 1]
+        flow += 1
 
-        shared_nodes = find_shared_nodes (list_of_paths)
-        shared_edges = find_shared_edges (list_of_paths)
-        
-        overall_cost = 0
-        list_of_costs = [item["cost"] for item in combi]
-        for cost in list_of_costs:
-            overall_cost += + cost 
-        overall_cost = overall_cost - cal_nodes_cost(G,shared_nodes) - cal_edges_cost(G,shared_edges)
+    # Decompose the flow into paths, following arcs that carry flow
+    names = G._names
+    paths = []
+    for _ in range(flow):
+        walk = [source]
+        u = source
+        while u != sink:
+            for a in arcs[u]:
+                if a % 2 == 0 and caps[a ^ 1] > 0:
+                    caps[a ^ 1] -= 1
+                    u = heads[a]
+                    walk.append(u)
+                    break
+        nodes = walk if disjoint == "edge" else [u // 2 for u in walk[::2]]
+        # A zero cost cycle may ride along a path, cut it out
+        path = []
+        for node in nodes:
+            if node in path:
+                del path[path.index(node) + 1:]
+            else:
+                path.append(node)
+        cost = sum(G.edge_cost(u, v) + device_cost[v] for u, v in zip(path, path[1:]))
+        paths.append({
+            "path": [names[u] for u in path],
+            "cost": cost - device_cost[t],
+            "dst": dst,
+        })
+    paths.sort(key=lambda x: x["cost"])
+    return {
+        "paths": paths,
+        "total_cost": sum(path["cost"] for path in paths),
+        "disjoint": disjoint,
+        "requested": K,
+        "found": len(paths),
+    }
 
-        part_of_output = {"subpaths": combi, "shared_devices": shared_nodes, "shared_connections": shared_edges, "overall_cost": overall_cost}
-        output.append(part_of_output)
 
-    output = sorted(output, key=lambda x: x["overall_cost"])
+def batch_k_shortest_path(G: Graph, queries: list[Tuple[str, list[str], int]]):
+    # Queries sharing a source are answered by a single search from it: one
+    # shortest path tree for all destinations, run to the largest K and
+    # truncated per query since Yen yields paths in cost order.
+    by_source = {}
+    for src, dst, K in queries:
+        dsts, max_k = by_source.get(src, (set(), 0))
+        by_source[src] = (dsts | set(dst), max(max_k, K))
+    paths = {
+        src: k_shortest_path(G, src, sorted(dsts), K)
+        for src, (dsts, K) in by_source.items()
+    }
+    return [
+        {dest: paths[src][dest][:K] for dest in dst}
+        for src, dst, K in queries
+    ]
 
-    if len(output) > K:
-        output = output[:K]
 
-    return output
\ No newline at end of file
+def cost_matrix(G: Graph, sources: list[str], destinations: list[str]) -> dict:
+    # Cost of the cheapest path from every source to every destination, None
+    # when there is none, and the device the path leaves the source through.
+    # One shortest path tree per source, cached trees are reused. New ones
+    # stop once every destination is settled and are not cached, so a full
+    # matrix does not evict the trees of the hot sources.
+    dst_ids = [G.node_id(name) for name in destinations]
+    names, device_cost = G._names, G._device_cost
+    costs = []
+    next_hops = []
+    expanded = 0
+    for src in sources:
+        s = G.node_id(src)
+        row_costs = [None] * len(dst_ids)
+        row_hops = [None] * len(dst_ids)
+        costs.append(row_costs)
+        next_hops.append(row_hops)
+        if G.reachability is not None and not any(
+                G.reachability.reaches(s, t) for t in dst_ids
+        ):
+            continue
+        tree = G.trees.get(s)
+        if tree is None:
+            stats = {}
+            tree = _dijkstra(G, s, stats=stats, until=set(dst_ids))
+            expanded += stats["expanded"]
+        dist, parent = tree
+        # First device after s on the tree path to each node, filled in by
+        # walking up to the nearest node that already has one
+        first = {s: None}
+        for j, t in enumerate(dst_ids):
+            if t == s:
+                row_costs[j] = 0
+                continue
+            if t not in dist:
+                continue
+            chain = []
+            v = t
+            while v not in first:
+                chain.append(v)
+                v = parent[v]
+            hop = first[v]
+            for u in reversed(chain):
+                hop = u if hop is None else hop
+                first[u] = hop
+            row_costs[j] = dist[t] - device_cost[t]
+            row_hops[j] = names[first[t]]
+    return {
+        "sources": sources,
+        "destinations": destinations,
+        "costs": costs,
+        "next_hops": next_hops,
+        "expanded": expanded,
+    }
@@ -2,8 +2,8 @@ from typing import Literal
 
 from pydantic import BaseModel
 from pydantic import constr, model_validator
-from sqlalchemy import Boolean, CheckConstraint, ForeignKey, Integer, String, \
-    UniqueConstraint
+from sqlalchemy import Boolean, CheckConstraint, ForeignKey, Index, Integer, \
+    String, UniqueConstraint
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -38,7 +38,13 @@ class Devices(Base):
                 f"{self.isDest}, Status: {self.status}, Cost: {self.cost})")
 
     __table_args__ = (
-        CheckConstraint("~(isSource & isDest) > 0", "nand_src_dest"),
+        CheckConstraint("~(isSource & isDest) > 0", "nand_src_dest").ddl_if(
+            dialect="mssql"
+        ),
+        # Bitwise not of the SQL Server check is -1 or -2 on other databases
+        CheckConstraint('NOT ("isSource" AND "isDest")', "nand_src_dest").ddl_if(
+            callable_=lambda ddl, target, bind, dialect, **kw: dialect.name != "mssql"
+        ),
         CheckConstraint("status in (0, 1, 2)", "valid_status"),
     )
 
@@ -70,7 +76,7 @@ class Connections(Base):
         foreign_keys="Connections.dst"
     )
 
-    component: Mapped["ComponentPaths"] = relationship(
+    component: Mapped[list["ComponentPaths"]] = relationship(
         back_populates="conn",
         cascade="all, delete"
     )
@@ -101,11 +107,18 @@ class BestPaths(Base):
         String(30),
         ForeignKey("devices.name", ondelete="NO ACTION"),
     )
+    # A stored path is the rank-th best of the num_best_path paths computed
+    # for (src, dst) on graph snapshot `version`
+    num_best_path: Mapped[int] = mapped_column(Integer, nullable=False)
+    rank: Mapped[int] = mapped_column(Integer, nullable=False)
+    cost: Mapped[int] = mapped_column(Integer, nullable=False)
+    version: Mapped[int] = mapped_column(Integer, nullable=False)
 
     # Relationship of foreign key
     components: Mapped[list["ComponentPaths"]] = relationship(
         back_populates="path",
         cascade="all, delete",
+        order_by="ComponentPaths.position",
     )
 
     # Defining Constraint
@@ -114,6 +127,7 @@ class BestPaths(Base):
             "src<>dst",
             "best_path_non_self_loop",
         ),
+        Index("best_path_lookup", "src", "dst", "num_best_path", "version"),
     )
 
 
@@ -122,10 +136,14 @@ class ComponentPaths(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True)
 
-    pathID: Mapped[int] = mapped_column(ForeignKey("bestpaths.id", ondelete="CASCADE"))
+    pathID: Mapped[int] = mapped_column(
+        ForeignKey("bestpaths.id", ondelete="CASCADE"), index=True
+        )
     connID: Mapped[int] = mapped_column(
-        ForeignKey("connections.id", ondelete="CASCADE")
+        ForeignKey("connections.id", ondelete="CASCADE"), index=True
         )
+    # Order of the connection along the path
+    position: Mapped[int] = mapped_column(Integer, nullable=False)
 
     # Relationship of foreign key
     path: Mapped["BestPaths"] = relationship(
@@ -137,6 +155,15 @@ class ComponentPaths(Base):
     )
 
 
+class GraphVersion(Base):
+    __tablename__ = "graphversion"
+    # Single row counting the writes to devices and connections. Each write
+    # bumps it in its own transaction, API processes compare it with the
+    # version of their cached graph.
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    version: Mapped[int] = mapped_column(Integer, nullable=False)
+
+
 class DeviceData(BaseModel):
     name: constr(to_upper=True, strip_whitespace=True, max_length=30)
     isSource: bool
@@ -167,3 +194,9 @@ class ConnectionData(BaseModel):
 
     class Config:
         orm_mode = True
+
+
+class PathQuery(BaseModel):
+    src: constr(to_upper=True, strip_whitespace=True, max_length=30)
+    dst: list[constr(to_upper=True, strip_whitespace=True, max_length=30)]
+    num_best_path: int = 5
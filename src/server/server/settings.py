@@ -10,7 +10,10 @@ DB_PASSWD = os.getenv("DB_PASSWD", "Password@123456")
 DB_ADDR = os.getenv("DB_ADDR", "172.18.0.1")
 DB_PORT = os.getenv("DB_PORT", 1433)
 DB_NAME = os.getenv("DB_NAME", "TestDB")
-connection_url = URL.create(
+# A full SQLAlchemy URL, e.g. sqlite:///plant.db, replaces the SQL Server
+# connection above. Used by the load harness and local runs.
+DB_URL = os.getenv("DB_URL", "")
+connection_url = DB_URL or URL.create(
     f"{DATABASE}+{DIALECT}",
     username=DB_USR,
     password=DB_PASSWD,
@@ -22,3 +25,35 @@ connection_url = URL.create(
         "TrustServerCertificate": "yes",
     }
 )
+
+# Seconds before the cached graph snapshot is reloaded to pick up
+# out-of-band database edits. 0 disables the periodic reload.
+GRAPH_CACHE_TTL = float(os.getenv("GRAPH_CACHE_TTL", 0))
+
+# Route computation runs in a pool of this many worker processes so path
+# queries scale across cores without holding the GIL against the API
+# threads. 0 computes routes in the default threadpool instead.
+ROUTING_WORKERS = int(os.getenv("ROUTING_WORKERS", 0))
+# Seconds a single route computation may take before the request fails. A
+# process pool that ran past it is replaced so the computation stops. In the
+# threadpool it cannot be stopped and holds one of the threadpool's threads
+# until it finishes, use the process pool when queries can run that long.
+ROUTING_TIMEOUT = float(os.getenv("ROUTING_TIMEOUT", 30))
+
+# Most destinations a /combined/paths query may combine. The combinations of
+# the per destination paths are enumerated lazily, but in the worst case
+# their number still grows exponentially with the destinations.
+MAX_COMBINED_DESTINATIONS = int(os.getenv("MAX_COMBINED_DESTINATIONS", 16))
+
+# Number of landmark devices in the ALT index used to direct single
+# destination searches. 0 disables the index.
+NUM_LANDMARKS = int(os.getenv("NUM_LANDMARKS", 0))
+
+# Fraction of SQL statements logged with their execution time, replacing the
+# engine echo. 0 disables the trace, 1 logs every statement.
+SQL_TRACE_SAMPLE = float(os.getenv("SQL_TRACE_SAMPLE", 0))
+
+# Graph snapshot file shared by the API processes of a host, e.g. under
+# /dev/shm. One process builds the graph and every other one maps the file
+# instead of loading it from the database. Empty keeps a graph per process.
+GRAPH_SNAPSHOT_PATH = os.getenv("GRAPH_SNAPSHOT_PATH", "")
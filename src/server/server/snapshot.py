@@ -0,0 +1,122 @@
+import fcntl
+import mmap
+import os
+import struct
+import threading
+from array import array
+from contextlib import contextmanager
+from typing import Callable
+
+from routing import Graph
+
+# Binary graph snapshot shared by every server process. One process builds
+# the graph and writes its CSR arrays to a file, the others map the file
+# read-only and build nothing but the name index. The header carries the
+# graph version, readers map the file again once the database version is
+# ahead of the graph they hold. A new version is written next to the file
+# and renamed over it, a mapping of the old file stays valid.
+#
+# Layout: header, section table, then each section 8 byte aligned.
+#   header   magic, format, number of sections, graph version
+#   section  name, array typecode, offset, item count
+
+MAGIC = b"SEPGRAPH"
+FORMAT = 1
+_HEADER = struct.Struct("<8sIIQ")
+_SECTION = struct.Struct("<16s8sQQ")
+_ARRAYS = (
+    "_device_cost", "_disabled", "_offsets", "_targets", "_weights",
+    "_rev_offsets", "_rev_sources", "_rev_weights"
+)
+
+
+def dump(G: Graph, version: int, file) -> None:
+    names = "\0".join(G._names).encode()
+    sections = [("_names", "B", names, len(names))]
+    for name in _ARRAYS:
+        data = memoryview(getattr(G, name))
+        sections.append((name, data.format, data.cast("B"), len(data)))
+
+    offset = _HEADER.size + _SECTION.size * len(sections)
+    table = []
+    for name, typecode, data, count in sections:
+        offset += -offset % 8
+        table.append(_SECTION.pack(name.encode(), typecode.encode(), offset, count))
+        offset += len(data)
+    file.write(_HEADER.pack(MAGIC, FORMAT, len(sections), version))
+    file.write(b"".join(table))
+    position = _HEADER.size + _SECTION.size * len(sections)
+    for name, typecode, data, count in sections:
+        file.write(b"\0" * (-position % 8))
+        position += -position % 8
+        file.write(data)
+        position += len(data)
+
+
+def load(file) -> tuple[Graph, int]:
+    mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, fmt, num_sections, version = _HEADER.unpack_from(mapping, 0)
+    if magic != MAGIC or fmt != FORMAT:
+        raise ValueError(f"{file.name} is not a graph snapshot of format {FORMAT}")
+    view = memoryview(mapping)
+    arrays = {}
+    for i in range(num_sections):
+        name, typecode, offset, count = _SECTION.unpack_from(
+            mapping, _HEADER.size + i * _SECTION.size
+        )
+        typecode = typecode.rstrip(b"\0").decode()
+        size = count * array(typecode).itemsize
+        arrays[name.rstrip(b"\0").decode()] = view[offset:offset + size].cast(typecode)
+    names = bytes(arrays.pop("_names")).decode()
+    G = Graph.from_arrays(names.split("\0") if names else [], **arrays)
+    # The arrays point into the mapping, it lives as long as the graph
+    G._mapping = mapping
+    return G, version
+
+
+class GraphSnapshot:
+
+    def __init__(
+            self,
+            path: str,
+            prepare: Callable[[Graph], Graph] | None = None
+    ) -> None:
+        # prepare runs on every graph read from the file, e.g. to attach
+        # indexes that are not part of the snapshot. Graphs passed to
+        # publish are expected to be prepared already.
+        self.path = path
+        self._prepare = prepare
+        self._lock = threading.Lock()
+
+    def version(self) -> int | None:
+        try:
+            with open(self.path, "rb") as f:
+                return _HEADER.unpack(f.read(_HEADER.size))[3]
+        except FileNotFoundError:
+            return None
+
+    def read(self) -> tuple[Graph, int]:
+        with open(self.path, "rb") as f:
+            G, version = load(f)
+        if self._prepare is not None:
+            G = self._prepare(G)
+        return G, version
+
+    @contextmanager
+    def exclusive(self):
+        # Serialises builders across threads and processes
+        with self._lock, open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def publish(self, G: Graph, version: int) -> None:
+        # Write G as `version` and swap it in. Call under exclusive().
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            dump(G, version, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
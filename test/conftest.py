@@ -0,0 +1,86 @@
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "server", "server"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "server", "benchmark"))
+
+
+def make_graph(n: int, m: int, seed: int):
+    # n devices N0..N{n-1} and m connections with random costs, at most one
+    # direction per pair of devices like the connections table allows
+    rng = random.Random(seed)
+    vertices = [(f"N{i}", rng.randint(0, 5)) for i in range(n)]
+    m = min(m, n * (n - 1) // 2)
+    edges = {}
+    while len(edges) < m:
+        a, b = rng.sample(range(n), 2)
+        if (b, a) not in edges:
+            edges[a, b] = rng.randint(1, 9)
+    return vertices, [(f"N{a}", f"N{b}", cost) for (a, b), cost in edges.items()]
+
+
+def simple_paths(vertices, edges, src: str, dst: str, disabled=()):
+    # Every simple path from src to dst as (cost, path) in cost order. The
+    # cost counts the connections and the devices strictly between src and
+    # dst, like the searches do.
+    device_cost = dict(vertices)
+    adjacency = {}
+    for u, v, cost in edges:
+        adjacency.setdefault(u, []).append((v, cost))
+    found = []
+
+    def extend(path, cost):
+        u = path[-1]
+        if u == dst:
+            found.append((cost, list(path)))
+            return
+        for v, w in adjacency.get(u, ()):
+            if v in path or v in disabled:
+                continue
+            path.append(v)
+            extend(path, cost + w + (device_cost[v] if v != dst else 0))
+            path.pop()
+
+    if src not in disabled and dst not in disabled:
+        extend([src], 0)
+    return sorted(found)
+
+
+@pytest.fixture
+def random_graph():
+    return make_graph
+
+
+@pytest.fixture
+def brute_force():
+    return simple_paths
+
+
+@pytest.fixture(scope="session")
+def api_app(tmp_path_factory):
+    # main.py builds its engine on import, on a SQLite stand-in here
+    os.environ["DB_URL"] = f"sqlite:///{tmp_path_factory.mktemp('db') / 'plant.db'}"
+    import main
+    return main
+
+
+@pytest.fixture
+def api(api_app):
+    # Client on an empty plant database, seed it through the API
+    from fastapi.testclient import TestClient
+    from sqlalchemy import delete
+
+    import path_store
+    from schema import Base, GraphVersion
+
+    with api_app.Session() as session:
+        for table in reversed(Base.metadata.sorted_tables):
+            if table.name != GraphVersion.__tablename__:
+                session.execute(delete(table))
+        path_store.bump_version(session)
+        session.commit()
+    with TestClient(api_app.app) as client:
+        yield client
@@ -0,0 +1,59 @@
+from itertools import product
+
+import pytest
+
+from generators import layered_plant
+from routing import Graph, combine_paths, k_shortest_path, multilple_dest_path
+
+
+def full_product(G, result, K):
+    # The exhaustive enumeration multilple_dest_path replaced
+    combinations = [combine_paths(G, combi) for combi in product(*result.values())]
+    return sorted(combinations, key=lambda x: x["overall_cost"])[:K]
+
+
+@pytest.mark.parametrize("K", [1, 3, 10, 100])
+@pytest.mark.parametrize("seed", range(25))
+def test_lazy_combinations_match_full_product(random_graph, seed, K):
+    vertices, edges = random_graph(10, 26, seed)
+    G = Graph(vertices, edges)
+    destinations = ["N4", "N6", "N9"] if seed % 2 else ["N3", "N5", "N7", "N9"]
+    result = k_shortest_path(G, "N0", destinations, 4)
+    if any(len(paths) == 0 for paths in result.values()):
+        assert multilple_dest_path(G, result, K) == []
+        return
+    assert multilple_dest_path(G, result, K) == full_product(G, result, K)
+
+
+def test_shared_edge_discounts():
+    # The second best path to every dst goes through A->B, combining them
+    # shares the connection and the device B. The cheapest combination is
+    # not the one of the cheapest paths once the sharing is counted.
+    vertices = [("A", 0), ("B", 5), ("C", 1), ("D", 1), ("E", 2), ("X", 1), ("Y", 1), ("Z", 1)]
+    edges = [
+        ("A", "B", 10), ("B", "C", 1), ("B", "D", 1), ("B", "E", 1),
+        ("A", "X", 10), ("X", "C", 1), ("A", "Y", 10), ("Y", "D", 1),
+        ("A", "Z", 10), ("Z", "E", 1), ("C", "D", 4), ("D", "E", 4),
+    ]
+    G = Graph(vertices, edges)
+    result = k_shortest_path(G, "A", ["C", "D", "E"], 3)
+    expected = full_product(G, result, 27)
+    assert multilple_dest_path(G, result, 27) == expected
+    assert expected[0]["shared_connections"] == [("A", "B")]
+    assert expected[0]["overall_cost"] < sum(paths[0]["cost"] for paths in result.values())
+    for K in range(1, 27):
+        assert multilple_dest_path(G, result, K) == expected[:K]
+
+
+@pytest.mark.parametrize("destinations", [4, 6, 8, 12])
+def test_plant_combinations_stay_below_full_product(destinations):
+    # Destinations of a layered plant split early, so only the first
+    # connections can be shared and the bound prunes most of the lattice
+    topology = layered_plant(width=20, destinations=12)
+    G = Graph(topology.vertices, topology.edges)
+    result = k_shortest_path(G, topology.sources[0], topology.destinations[:destinations], 5)
+    stats = {}
+    combined = multilple_dest_path(G, result, 5, stats)
+    assert stats["combinations"] <= 5 ** destinations // 20
+    if destinations <= 6:
+        assert combined == full_product(G, result, 5)
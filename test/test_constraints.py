@@ -0,0 +1,119 @@
+import random
+
+import pytest
+
+import routing
+from routing import Constraints, Graph, k_shortest_path, k_shortest_path_with_stats
+
+
+def satisfies(path: list[str], cost: int, constraints: Constraints) -> bool:
+    if set(path) & constraints.avoid_devices:
+        return False
+    if set(zip(path, path[1:])) & constraints.avoid_connections:
+        return False
+    if constraints.max_hops is not None and len(path) - 1 > constraints.max_hops:
+        return False
+    if constraints.max_cost is not None and cost > constraints.max_cost:
+        return False
+    # Waypoints in order along the path
+    remaining = iter(path)
+    return all(waypoint in remaining for waypoint in constraints.waypoints)
+
+
+def random_constraints(rng: random.Random, vertices, edges, src: str, dst: str) -> Constraints:
+    others = [name for name, _ in vertices if name not in (src, dst)]
+    avoid = rng.sample(others, rng.randint(0, 1))
+    return Constraints(
+        avoid_devices=frozenset(avoid),
+        avoid_connections=frozenset(
+            (u, v) for u, v, _ in rng.sample(edges, rng.randint(0, 2))
+        ),
+        waypoints=tuple(rng.sample([name for name in others if name not in avoid], rng.randint(0, 2))),
+        max_hops=rng.choice([None, 3, 4, 5]),
+        max_cost=rng.choice([None, 20, 40]),
+    )
+
+
+@pytest.mark.parametrize("search", ["forward", "bidirectional"])
+@pytest.mark.parametrize("seed", range(150))
+def test_constrained_paths_match_filtered_brute_force(random_graph, brute_force, seed, search):
+    rng = random.Random(seed)
+    vertices, edges = random_graph(9, 22, seed)
+    G = Graph(vertices, edges)
+    src, dst = "N0", rng.choice(["N3", "N5", "N8"])
+    constraints = random_constraints(rng, vertices, edges, src, dst)
+    K = rng.randint(1, 6)
+    expected = [
+        (cost, path) for cost, path in brute_force(vertices, edges, src, dst)
+        if satisfies(path, cost, constraints)
+    ]
+    found = k_shortest_path(G, src, dst, K, search=search, constraints=constraints)[dst]
+    assert [item["cost"] for item in found] == [cost for cost, _ in expected][:K]
+    assert len({tuple(item["path"]) for item in found}) == len(found)
+    for item in found:
+        assert (item["cost"], item["path"]) in expected
+
+
+@pytest.mark.parametrize("field, value", [
+    ("avoid_devices", frozenset({"N1"})),
+    ("avoid_connections", frozenset({("N0", "N1")})),
+    ("waypoints", ("N2",)),
+    ("max_hops", 2),
+    ("max_cost", 12),
+])
+def test_each_constraint_alone(random_graph, brute_force, field, value):
+    constraints = Constraints()._replace(**{field: value})
+    for seed in range(30):
+        vertices, edges = random_graph(8, 20, seed)
+        G = Graph(vertices, edges)
+        expected = [
+            (cost, path) for cost, path in brute_force(vertices, edges, "N0", "N6")
+            if satisfies(path, cost, constraints)
+        ]
+        found = k_shortest_path(G, "N0", "N6", 1000, constraints=constraints)["N6"]
+        assert sorted((item["cost"], item["path"]) for item in found) == expected
+
+
+def ladder(n: int, prefix: str, start: str):
+    # n diamonds in a row after start, 2^n equal cost paths to the last device
+    vertices, edges, last = [], [], start
+    for i in range(n):
+        a, b, m = f"{prefix}{i}a", f"{prefix}{i}b", f"{prefix}{i}m"
+        vertices += [(a, 1), (b, 1), (m, 0)]
+        edges += [(last, a, 1), (last, b, 1), (a, m, 1), (b, m, 1)]
+        last = m
+    return vertices, edges, last
+
+
+def test_waypoint_segments_avoid_other_stops():
+    # The only way to W runs through dst, so no simple path visits W
+    vertices, edges, last = ladder(16, "L", "S")
+    vertices += [("S", 0), ("D", 0), ("W", 0), ("X", 0)]
+    edges += [(last, "D", 1), ("D", "W", 1), ("W", "X", 1), ("X", "D", 1)]
+    G = Graph(vertices, edges)
+    result, stats = k_shortest_path_with_stats(
+        G, "S", "D", 3, constraints=Constraints(waypoints=("W",))
+    )
+    assert result == {"D": []}
+    assert stats["expanded"] < 100
+
+
+def test_waypoint_combinations_are_bounded(monkeypatch):
+    # Both segments pass M, every combination of their paths repeats it
+    monkeypatch.setattr(routing, "MAX_WAYPOINT_COMBINATIONS", 50)
+    vertices, edges, m = ladder(12, "A", "S")
+    more_vertices, more_edges, last = ladder(12, "B", m)
+    vertices += more_vertices + [("S", 0), ("W", 0), ("D", 0)]
+    edges += more_edges + [(last, "W", 1), ("W", m, 1), (m, "D", 1)]
+    G = Graph(vertices, edges)
+    result, stats = k_shortest_path_with_stats(
+        G, "S", "D", 3, constraints=Constraints(waypoints=("W",))
+    )
+    assert result == {"D": []}
+    assert stats["candidates"] < 1000
+
+
+def test_legacy_rejects_constraints(random_graph):
+    G = Graph(*random_graph(6, 10, 0))
+    with pytest.raises(ValueError):
+        k_shortest_path(G, "N0", "N5", 3, algorithm="legacy", constraints=Constraints(max_hops=2))
@@ -0,0 +1,96 @@
+import io
+import random
+
+import numpy as np
+import pytest
+
+from dynamic import DeviceChange, apply_change
+from reachability import ReachabilityIndex
+from routing import Graph, _dijkstra, cost_matrix
+
+
+def random_matrix_graph(random_graph, seed: int):
+    rng = random.Random(seed)
+    vertices, edges = random_graph(12, rng.randint(12, 40), seed)
+    G = Graph(vertices, edges)
+    for name in rng.sample(G._names, rng.randint(0, 2)):
+        G = apply_change(G, DeviceChange(name, False, G.get_device_cost(name)))
+    names = [name for name in G._names if not G._disabled[G.node_id(name)]]
+    return G, rng.sample(names, 4), rng.sample(names, 5)
+
+
+def check_matrix(G: Graph, matrix: dict) -> None:
+    # Costs of a fresh search per pair, next hops start a cheapest path
+    device_cost = G._device_cost
+    dist = {}
+    for i, src in enumerate(matrix["sources"]):
+        s = G.node_id(src)
+        for j, dst in enumerate(matrix["destinations"]):
+            t = G.node_id(dst)
+            dist.setdefault(s, _dijkstra(G, s)[0])
+            cost, hop = matrix["costs"][i][j], matrix["next_hops"][i][j]
+            if s == t:
+                assert (cost, hop) == (0, None)
+            elif t not in dist[s]:
+                assert (cost, hop) == (None, None)
+            else:
+                assert cost == dist[s][t] - device_cost[t]
+                h = G.node_id(hop)
+                dist.setdefault(h, _dijkstra(G, h)[0])
+                assert cost == G.edge_cost(s, h) + device_cost[h] + dist[h][t] - device_cost[t]
+
+
+@pytest.mark.parametrize("seed", range(60))
+def test_matrix_matches_fresh_searches(random_graph, seed):
+    G, sources, destinations = random_matrix_graph(random_graph, seed)
+    check_matrix(G, cost_matrix(G, sources, destinations))
+
+
+@pytest.mark.parametrize("seed", range(60))
+def test_cached_trees_and_reachability_give_the_same_matrix(random_graph, seed):
+    G, sources, destinations = random_matrix_graph(random_graph, seed)
+    fresh = cost_matrix(G, sources, destinations)
+    # Searches that stopped early at the destinations are not cached
+    assert not G.trees
+    for src in sources[::2]:
+        G.shortest_path_tree(G.node_id(src))
+    G.reachability = ReachabilityIndex(G)
+    matrix = cost_matrix(G, sources, destinations)
+    check_matrix(G, matrix)
+    assert matrix["costs"] == fresh["costs"]
+    assert matrix["expanded"] <= fresh["expanded"]
+
+
+def add(api, endpoint: str, **item) -> None:
+    response = api.post(endpoint, json=item)
+    assert response.status_code == 200, response.text
+
+
+def test_npz_export_round_trips(api):
+    # S1 reaches both destinations, S2 only D1, D2 is reached through X
+    for name, source, dest in [
+        ("S1", True, False), ("S2", True, False), ("X", False, False),
+        ("D1", False, True), ("D2", False, True),
+    ]:
+        add(api, "/add/devices/", name=name, isSource=source, isDest=dest, status=0, cost=2)
+    for src, dst, cost in [("S1", "X", 1), ("X", "D2", 3), ("S1", "D1", 4), ("S2", "D1", 1)]:
+        add(api, "/add/connections/", src=src, dst=dst, cost=cost)
+
+    matrix = api.get("/cost/matrix", params={"next_hops": True}).json()
+    assert matrix["sources"] == ["S1", "S2"]
+    assert matrix["destinations"] == ["D1", "D2"]
+    assert matrix["costs"] == [[4, 6], [1, None]]
+    assert matrix["next_hops"] == [["D1", "X"], ["D1", None]]
+
+    response = api.get("/cost/matrix", params={"next_hops": True, "format": "npz"})
+    assert response.status_code == 200
+    with np.load(io.BytesIO(response.content)) as arrays:
+        assert int(arrays["version"]) == matrix["version"]
+        assert arrays["sources"].tolist() == matrix["sources"]
+        assert arrays["destinations"].tolist() == matrix["destinations"]
+        assert arrays["costs"].tolist() == [[4, 6], [1, -1]]
+        assert arrays["next_hops"].tolist() == [["D1", "X"], ["D1", ""]]
+
+    response = api.get("/cost/matrix", params={"format": "npz"})
+    with np.load(io.BytesIO(response.content)) as arrays:
+        assert "next_hops" not in arrays
@@ -0,0 +1,82 @@
+from itertools import combinations
+
+import pytest
+
+from dynamic import DeviceChange, apply_change
+from routing import Graph, disjoint_paths
+
+
+def shared(path: list[str], disjoint: str) -> set:
+    # What two disjoint paths may not have in common
+    return set(zip(path, path[1:])) if disjoint == "edge" else set(path[1:-1])
+
+
+def best_total_cost(paths, K: int, disjoint: str):
+    # Cheapest total cost of K pairwise disjoint paths, None without any
+    best = None
+    for combination in combinations(paths, K):
+        used = set()
+        for _, path in combination:
+            if used & shared(path, disjoint):
+                break
+            used |= shared(path, disjoint)
+        else:
+            total = sum(cost for cost, _ in combination)
+            best = total if best is None else min(best, total)
+    return best
+
+
+@pytest.mark.parametrize("disjoint", ["edge", "node"])
+@pytest.mark.parametrize("seed", range(80))
+def test_disjoint_paths_match_brute_force(random_graph, brute_force, seed, disjoint):
+    vertices, edges = random_graph(8, 20, seed)
+    G = Graph(vertices, edges)
+    out_of_service = {"N2"} if seed % 4 == 0 else set()
+    for name in out_of_service:
+        G = apply_change(G, DeviceChange(name, False, G.get_device_cost(name)))
+    paths = brute_force(vertices, edges, "N0", "N7", out_of_service)
+    for K in (1, 2, 3):
+        result = disjoint_paths(G, "N0", "N7", K, disjoint)
+        # As many paths as can be disjoint, at the cheapest total cost
+        found = K
+        while found > 0 and best_total_cost(paths, found, disjoint) is None:
+            found -= 1
+        assert result["found"] == found == len(result["paths"])
+        assert result["requested"] == K
+        if found:
+            assert result["total_cost"] == best_total_cost(paths, found, disjoint)
+        for item in result["paths"]:
+            assert (item["cost"], item["path"]) in paths
+        for a, b in combinations(result["paths"], 2):
+            assert not shared(a["path"], disjoint) & shared(b["path"], disjoint)
+
+
+def test_fewer_disjoint_paths_than_requested():
+    # Two routes into M and a single connection on from M: two edge disjoint
+    # paths can not exist, and M is on every path
+    vertices = [("S", 0), ("A", 1), ("B", 2), ("M", 1), ("T", 0)]
+    edges = [("S", "A", 1), ("S", "B", 1), ("A", "M", 1), ("B", "M", 1), ("M", "T", 1)]
+    G = Graph(vertices, edges)
+    for disjoint in ("edge", "node"):
+        result = disjoint_paths(G, "S", "T", 3, disjoint)
+        assert result["found"] == 1
+        assert result["paths"] == [{"path": ["S", "A", "M", "T"], "cost": 5, "dst": "T"}]
+        assert result["total_cost"] == 5
+
+
+def test_node_disjoint_is_stricter_than_edge_disjoint():
+    # Both routes pass through M on different connections
+    vertices = [("S", 0), ("A", 1), ("B", 1), ("M", 1), ("C", 1), ("D", 1), ("T", 0)]
+    edges = [
+        ("S", "A", 1), ("S", "B", 1), ("A", "M", 1), ("B", "M", 1),
+        ("M", "C", 1), ("M", "D", 1), ("C", "T", 1), ("D", "T", 1),
+    ]
+    G = Graph(vertices, edges)
+    assert disjoint_paths(G, "S", "T", 2, "edge")["found"] == 2
+    assert disjoint_paths(G, "S", "T", 2, "node")["found"] == 1
+
+
+def test_unknown_disjointness(random_graph):
+    G = Graph(*random_graph(5, 8, 0))
+    with pytest.raises(ValueError):
+        disjoint_paths(G, "N0", "N4", 2, "vertex")
@@ -0,0 +1,102 @@
+import random
+import threading
+
+import pytest
+
+from dynamic import ConnectionChange, DeviceChange, apply_change
+from routing import Graph, _dijkstra
+
+
+def random_change(G: Graph, edges, rng: random.Random):
+    kind = rng.choice(["increase", "decrease", "device_cost", "down", "up"])
+    if kind in ("increase", "decrease"):
+        src, dst, _ = rng.choice(edges)
+        cost = G.edge_cost(G.node_id(src), G.node_id(dst))
+        step = rng.randint(1, 6)
+        return ConnectionChange(src, dst, cost + step if kind == "increase" else max(1, cost - step))
+    name = rng.choice(G._names)
+    u = G.node_id(name)
+    if kind == "down":
+        return DeviceChange(name, False, G._device_cost[u])
+    if kind == "up":
+        return DeviceChange(name, True, G._device_cost[u])
+    return DeviceChange(name, not G._disabled[u], rng.randint(0, 6))
+
+
+def check_tree(G: Graph, src: int, tree):
+    dist, parent = tree
+    assert dist == _dijkstra(G, src)[0]
+    assert parent.keys() == dist.keys()
+    for node, p in parent.items():
+        if node == src:
+            continue
+        assert not G._disabled[p]
+        assert dist[node] == dist[p] + G.edge_cost(p, node) + G._device_cost[node]
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_repaired_trees_match_fresh_dijkstra(random_graph, seed):
+    rng = random.Random(seed)
+    vertices, edges = random_graph(12, 30, seed)
+    G = Graph(vertices, edges)
+    sources = rng.sample(range(len(G)), 4)
+    for src in sources:
+        G.shortest_path_tree(src)
+    for _ in range(25):
+        change = random_change(G, edges, rng)
+        H = apply_change(G, change)
+        assert H is not None
+        for src in sources:
+            if src in G.trees and not H._disabled[src]:
+                assert src in H.trees
+        for src, tree in H.trees.items():
+            check_tree(H, src, tree)
+        G = H
+
+
+def test_unchanged_graph_is_reused(random_graph):
+    vertices, edges = random_graph(8, 16, 3)
+    G = Graph(vertices, edges)
+    src, dst, cost = edges[0]
+    assert apply_change(G, ConnectionChange(src, dst, cost)) is G
+    assert apply_change(G, DeviceChange("N1", True, G.get_device_cost("N1"))) is G
+
+
+def test_unknown_elements_need_a_reload(random_graph):
+    vertices, edges = random_graph(8, 16, 3)
+    G = Graph(vertices, edges)
+    pairs = {(src, dst) for src, dst, _ in edges}
+    missing = next(
+        (f"N{a}", f"N{b}") for a in range(8) for b in range(8)
+        if a != b and (f"N{a}", f"N{b}") not in pairs
+    )
+    assert apply_change(G, ConnectionChange(*missing, 1)) is None
+    assert apply_change(G, DeviceChange("NEW", True, 1)) is None
+    assert apply_change(G, DeviceChange("NEW", False, 1)) is G
+
+
+def test_changes_while_queries_cache_trees(random_graph):
+    # Queries on the cached graph add and evict trees while a writer
+    # applies changes to it
+    vertices, edges = random_graph(60, 200, 1)
+    G = Graph(vertices, edges)
+    for src in range(40):
+        G.shortest_path_tree(src)
+    done = threading.Event()
+
+    def query():
+        src = 0
+        while not done.is_set():
+            G.shortest_path_tree(src % len(G))
+            src += 1
+
+    reader = threading.Thread(target=query)
+    reader.start()
+    rng = random.Random(0)
+    try:
+        for _ in range(200):
+            src, dst, cost = rng.choice(edges)
+            apply_change(G, ConnectionChange(src, dst, cost + rng.randint(1, 5)))
+    finally:
+        done.set()
+        reader.join()
@@ -0,0 +1,70 @@
+import pytest
+
+from dynamic import DeviceChange, apply_change
+from landmarks import LandmarkIndex
+from reachability import ReachabilityIndex
+from routing import INF, Graph, _dijkstra, k_shortest_path
+from test_shortest_path import check_paths
+
+
+def with_disabled(G: Graph, names) -> Graph:
+    for name in names:
+        G = apply_change(G, DeviceChange(name, False, G.get_device_cost(name)))
+    return G
+
+
+def sparse_graph(random_graph, seed: int) -> Graph:
+    # Few connections leave many pairs unreachable
+    vertices, edges = random_graph(12, 10 + seed % 20, seed)
+    return with_disabled(Graph(vertices, edges), ["N5"] if seed % 3 == 0 else [])
+
+
+def check_admissible(G: Graph, index: LandmarkIndex) -> int:
+    # Every bound is at most the cost of the cheapest path, returns how many
+    # pairs were ruled out with INF
+    dist = [_dijkstra(G, v)[0] for v in range(len(G))]
+    ruled_out = 0
+    for t in range(len(G)):
+        lower_bound = index.heuristic(t)
+        for v in range(len(G)):
+            if G._disabled[v]:
+                continue
+            bound = lower_bound(v)
+            if t in dist[v]:
+                # The search pays the device cost of t, v's is already paid
+                assert bound <= dist[v][t], (v, t)
+            ruled_out += bound == INF
+    return ruled_out
+
+
+@pytest.mark.parametrize("seed", range(60))
+def test_heuristic_is_admissible(random_graph, seed):
+    G = sparse_graph(random_graph, seed)
+    check_admissible(G, LandmarkIndex(G, 3))
+
+
+def test_heuristic_rules_out_unreachable_devices(random_graph):
+    ruled_out = 0
+    for seed in range(20):
+        G = sparse_graph(random_graph, seed)
+        ruled_out += check_admissible(G, LandmarkIndex(G, 3))
+    assert ruled_out > 0
+
+
+@pytest.mark.parametrize("reachability", [False, True])
+@pytest.mark.parametrize("seed", range(60))
+def test_yen_with_landmarks_matches_brute_force(random_graph, brute_force, seed, reachability):
+    vertices, edges = random_graph(9, 14 + seed % 10, seed)
+    out_of_service = ["N2"] if seed % 4 == 0 else []
+    G = with_disabled(Graph(vertices, edges), out_of_service)
+    G.landmarks = LandmarkIndex(G, 3)
+    if reachability:
+        G.reachability = ReachabilityIndex(G)
+    for dst in ["N3", "N5", "N8"]:
+        expected = brute_force(vertices, edges, "N0", dst, set(out_of_service))
+        # A single destination is searched with the heuristic from the start
+        for K in (1, 5):
+            check_paths(k_shortest_path(G, "N0", dst, K)[dst], expected, K)
+    result = k_shortest_path(G, "N0", ["N3", "N5", "N8"], 5)
+    for dst in ["N3", "N5", "N8"]:
+        check_paths(result[dst], brute_force(vertices, edges, "N0", dst, set(out_of_service)), 5)
@@ -0,0 +1,40 @@
+def add_devices(api, names):
+    for name in names:
+        response = api.post("/add/devices/", json={
+            "name": name, "isSource": False, "isDest": False, "status": 0, "cost": 1
+        })
+        assert response.status_code == 200, response.text
+
+
+def pages(api, endpoint: str, limit: int):
+    # Follow X-Next-After until a page comes without it
+    params = {"limit": limit}
+    while True:
+        response = api.get(endpoint, params=params)
+        assert response.status_code == 200, response.text
+        yield response.json()
+        if "X-Next-After" not in response.headers:
+            return
+        params["after"] = response.headers["X-Next-After"]
+
+
+def test_device_pages_end_with_an_empty_page(api):
+    add_devices(api, "ABCDE")
+    found = list(pages(api, "/devices/", 5))
+    assert [[item["name"] for item in page] for page in found] == [list("ABCDE"), []]
+    found = list(pages(api, "/devices/", 2))
+    assert [[item["name"] for item in page] for page in found] == [["A", "B"], ["C", "D"], ["E"]]
+
+
+def test_connection_pages_end_with_an_empty_page(api):
+    add_devices(api, "ABCD")
+    for src, dst in [("A", "B"), ("B", "C"), ("C", "D"), ("A", "C")]:
+        response = api.post("/add/connections/", json={"src": src, "dst": dst, "cost": 1})
+        assert response.status_code == 200, response.text
+    found = list(pages(api, "/connections/", 2))
+    assert [len(page) for page in found] == [2, 2, 0]
+
+
+def test_unknown_device_is_not_found(api):
+    add_devices(api, "AB")
+    assert api.get("/devices/", params={"name": "X"}).status_code == 404
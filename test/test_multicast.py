@@ -0,0 +1,71 @@
+import random
+
+import pytest
+
+from dynamic import DeviceChange, apply_change
+from routing import Graph, multicast_tree
+
+
+def path_cost(G: Graph, path: list[str]) -> int:
+    # Connections and devices after src, without the device cost of dst
+    cost = sum(G[u, v] + G.get_device_cost(v) for u, v in zip(path, path[1:]))
+    return cost - G.get_device_cost(path[-1]) if len(path) > 1 else 0
+
+
+@pytest.mark.parametrize("seed", range(80))
+def test_tree_matches_the_graph(random_graph, brute_force, seed):
+    rng = random.Random(seed)
+    vertices, edges = random_graph(10, rng.randint(10, 30), seed)
+    G = Graph(vertices, edges)
+    disabled = set(rng.sample(["N2", "N5", "N7"], rng.randint(0, 1)))
+    for name in disabled:
+        G = apply_change(G, DeviceChange(name, False, G.get_device_cost(name)))
+    dst = rng.sample([f"N{i}" for i in range(1, 10)], rng.randint(1, 5))
+    result = multicast_tree(G, "N0", dst)
+
+    connections = {(u, v) for u, v, _ in edges}
+    tree = result["connections"]
+    assert set(tree) <= connections
+    assert not disabled & {node for edge in tree for node in edge}
+    # Every device of the tree but src is entered once
+    assert len({v for _, v in tree}) == len(tree)
+    assert "N0" not in {v for _, v in tree}
+    assert result["tree_cost"] == sum(G[u, v] + G.get_device_cost(v) for u, v in tree)
+
+    reachable = {dest for dest in dst if brute_force(vertices, edges, "N0", dest, disabled)}
+    assert result["unreachable"] == [dest for dest in dst if dest not in reachable]
+    assert [item["dst"] for item in result["subpaths"]] == [dest for dest in dst if dest in reachable]
+    for item in result["subpaths"]:
+        path = item["path"]
+        assert path[0] == "N0" and path[-1] == item["dst"]
+        assert set(zip(path, path[1:])) <= set(tree)
+        assert item["cost"] == path_cost(G, path)
+    assert result["overall_cost"] == sum(item["cost"] for item in result["subpaths"]) \
+        - sum(G.get_device_cost(name) for name in result["shared_devices"]) \
+        - sum(G[edge] for edge in result["shared_connections"])
+
+
+def test_single_destination_is_the_shortest_path(random_graph, brute_force):
+    for seed in range(30):
+        vertices, edges = random_graph(9, 22, seed)
+        G = Graph(vertices, edges)
+        expected = brute_force(vertices, edges, "N0", "N6")
+        result = multicast_tree(G, "N0", ["N6"])
+        if not expected:
+            assert result["unreachable"] == ["N6"]
+            continue
+        assert result["subpaths"][0]["cost"] == expected[0][0]
+
+
+def test_destinations_share_the_trunk():
+    # Both destinations hang off M, the tree runs S->M once
+    vertices = [("S", 0), ("M", 1), ("A", 1), ("B", 1), ("ISLAND", 1)]
+    edges = [("S", "M", 5), ("M", "A", 1), ("M", "B", 1), ("ISLAND", "S", 1)]
+    G = Graph(vertices, edges)
+    result = multicast_tree(G, "S", ["A", "B", "ISLAND"])
+    assert sorted(result["connections"]) == [("M", "A"), ("M", "B"), ("S", "M")]
+    assert result["tree_cost"] == 5 + 1 + 1 + 1 + 1 + 1
+    assert result["unreachable"] == ["ISLAND"]
+    assert [item["path"] for item in result["subpaths"]] == [["S", "M", "A"], ["S", "M", "B"]]
+    assert result["shared_connections"] == [("S", "M")]
+    assert result["overall_cost"] == 7 + 7 - 1 - 5
@@ -0,0 +1,84 @@
+import pytest
+
+import reachability
+from dynamic import DeviceChange, apply_change
+from reachability import ReachabilityIndex
+from routing import Graph, k_shortest_path, k_shortest_path_with_stats
+
+
+def reachable_from(G: Graph, u: int) -> set:
+    # Devices in service reachable from u by a plain graph search
+    if G._disabled[u]:
+        return set()
+    seen = {u}
+    stack = [u]
+    while stack:
+        for v, _ in G.successors(stack.pop()):
+            if not G._disabled[v] and v not in seen:
+                seen.add(v)
+                stack.append(v)
+    return seen
+
+
+def sparse_graph(random_graph, seed: int) -> Graph:
+    # Few connections and some devices out of service, many pairs are
+    # unreachable
+    vertices, edges = random_graph(14, 14 + seed % 10, seed)
+    G = Graph(vertices, edges)
+    for name in ("N3", "N11")[:seed % 3]:
+        G = apply_change(G, DeviceChange(name, False, G.get_device_cost(name)))
+    return G
+
+
+@pytest.mark.parametrize("seed", range(60))
+def test_index_matches_graph_search(random_graph, seed):
+    G = sparse_graph(random_graph, seed)
+    index = ReachabilityIndex(G)
+    for u in range(len(G)):
+        reached = reachable_from(G, u)
+        for v in range(len(G)):
+            assert index.reaches(u, v) == (v in reached), (u, v)
+
+
+@pytest.mark.parametrize("seed", range(60))
+def test_unreachable_pairs_are_rejected_without_a_search(random_graph, seed):
+    G = sparse_graph(random_graph, seed)
+    G.reachability = ReachabilityIndex(G)
+    src = next(u for u in range(len(G)) if not G._disabled[u])
+    reached = reachable_from(G, src)
+    for v in range(len(G)):
+        if v in reached or G._disabled[v]:
+            continue
+        dst = G.node_name(v)
+        assert not G.reachable(G.node_name(src), dst)
+        result, stats = k_shortest_path_with_stats(G, G.node_name(src), dst, 3)
+        assert result == {dst: []}
+        assert stats["expanded"] == 0
+
+
+@pytest.mark.parametrize("search", ["forward", "bidirectional"])
+@pytest.mark.parametrize("seed", range(60))
+def test_pruned_searches_match_unpruned(random_graph, seed, search):
+    G = sparse_graph(random_graph, seed)
+    names = [G.node_name(u) for u in range(len(G)) if not G._disabled[u]]
+    src, destinations = names[0], names[1:]
+    unpruned = {
+        dst: k_shortest_path_with_stats(G, src, dst, 4, search=search) for dst in destinations
+    }
+    G.reachability = ReachabilityIndex(G)
+    for dst in destinations:
+        result, stats = k_shortest_path_with_stats(G, src, dst, 4, search=search)
+        assert result == unpruned[dst][0]
+        assert stats["expanded"] <= unpruned[dst][1]["expanded"]
+    pruned = k_shortest_path(G, src, destinations, 4, search=search)
+    assert pruned == {dst: unpruned[dst][0][dst] for dst in destinations}
+
+
+def test_oversized_index_answers_maybe(random_graph, monkeypatch):
+    monkeypatch.setattr(reachability, "MAX_BYTES", 0)
+    G = sparse_graph(random_graph, 4)
+    index = ReachabilityIndex(G)
+    assert index.status()["bitsets"] is False
+    assert all(index.reaches(u, v) for u in range(len(G)) for v in range(len(G)))
+    G.reachability = index
+    assert G.reachable("N0", "N13")
@@ -0,0 +1,62 @@
+import pytest
+
+from dynamic import DeviceChange, apply_change
+from routing import Graph, k_shortest_path
+
+
+def check_paths(found, expected, K):
+    # Ties may come in any order, so costs are compared as a list and paths
+    # by membership
+    assert [item["cost"] for item in found] == [cost for cost, _ in expected][:K]
+    assert len({tuple(item["path"]) for item in found}) == len(found)
+    for item in found:
+        assert (item["cost"], item["path"]) in expected
+
+
+@pytest.mark.parametrize("search", ["forward", "bidirectional"])
+@pytest.mark.parametrize("seed", range(60))
+def test_yen_matches_brute_force(random_graph, brute_force, seed, search):
+    vertices, edges = random_graph(9, 20, seed)
+    G = Graph(vertices, edges)
+    destinations = ["N3", "N5", "N8"]
+    result = k_shortest_path(G, "N0", destinations, 5, search=search)
+    for dst in destinations:
+        check_paths(result[dst], brute_force(vertices, edges, "N0", dst), 5)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_k_larger_than_number_of_paths(random_graph, brute_force, seed):
+    vertices, edges = random_graph(7, 10, seed)
+    G = Graph(vertices, edges)
+    result = k_shortest_path(G, "N0", ["N4", "N6"], 1000)
+    for dst in ["N4", "N6"]:
+        expected = brute_force(vertices, edges, "N0", dst)
+        assert sorted((item["cost"], item["path"]) for item in result[dst]) == expected
+
+
+@pytest.mark.parametrize("search", ["forward", "bidirectional"])
+def test_disconnected_dst(random_graph, brute_force, search):
+    vertices, edges = random_graph(8, 20, 1)
+    vertices.append(("ISLAND", 1))
+    # Reachable from ISLAND but not the other way round
+    edges.append(("ISLAND", "N0", 1))
+    G = Graph(vertices, edges)
+    result = k_shortest_path(G, "N0", ["ISLAND", "N3"], 3, search=search)
+    assert result["ISLAND"] == []
+    check_paths(result["N3"], brute_force(vertices, edges, "N0", "N3"), 3)
+    assert k_shortest_path(G, "N0", "ISLAND", 1, search=search) == {"ISLAND": []}
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_out_of_service_devices(random_graph, brute_force, seed):
+    vertices, edges = random_graph(9, 22, seed)
+    G = Graph(vertices, edges)
+    disabled = {"N2", "N6"}
+    for name in disabled:
+        G = apply_change(G, DeviceChange(name, False, G.get_device_cost(name)))
+    result = k_shortest_path(G, "N0", ["N4", "N7"], 4)
+    for dst in ["N4", "N7"]:
+        expected = brute_force(vertices, edges, "N0", dst, disabled)
+        check_paths(result[dst], expected, 4)
+        assert not any(disabled & set(item["path"]) for item in result[dst])
+
@@ -0,0 +1,159 @@
+import random
+
+import pytest
+
+import path_store
+
+
+class Plant:
+    # What the database should hold, written through the API
+
+    def __init__(self, api, rng: random.Random, vertices, edges) -> None:
+        self.api = api
+        self.rng = rng
+        self.devices = {}
+        self.connections = {}
+        for name, cost in vertices:
+            self.put_device(name, 0, cost)
+        for src, dst, cost in edges:
+            self.put_connection(src, dst, cost)
+
+    def put_device(self, name: str, status: int, cost: int) -> None:
+        item = {"name": name, "isSource": False, "isDest": False, "status": status, "cost": cost}
+        if name in self.devices:
+            response = self.api.put("/update/devices/", json=item)
+        else:
+            response = self.api.post("/add/devices/", json=item)
+        assert response.status_code == 200, response.text
+        self.devices[name] = (status, cost)
+
+    def put_connection(self, src: str, dst: str, cost: int) -> None:
+        response = self.api.post("/add/connections/", json={"src": src, "dst": dst, "cost": cost})
+        assert response.status_code == 200, response.text
+        self.connections[src, dst] = cost
+
+    def delete_connection(self, src: str, dst: str) -> None:
+        response = self.api.request(
+            "DELETE", "/delete/connections", json={"src": src, "dst": dst, "cost": 0}
+        )
+        assert response.status_code == 200, response.text
+        del self.connections[src, dst]
+
+    def delete_device(self, name: str) -> None:
+        response = self.api.delete("/delete/devices", params={"name": name})
+        assert response.status_code == 200, response.text
+        del self.devices[name]
+        for src, dst in list(self.connections):
+            if name in (src, dst):
+                del self.connections[src, dst]
+
+    def batch(self, endpoint: str, items: list[dict]) -> None:
+        response = self.api.post(endpoint, json=items)
+        assert response.status_code == 200, response.text
+        assert all("error" not in result for result in response.json()), response.text
+
+    def random_write(self) -> None:
+        rng = self.rng
+        names = sorted(self.devices)
+        kind = rng.choice([
+            "device_cost", "device_status", "connection_cost", "connection_cost",
+            "add_connection", "delete_connection", "device_batch", "connection_batch",
+            "replace_device",
+        ])
+        if kind == "device_cost":
+            name = rng.choice(names)
+            status, cost = self.devices[name]
+            self.put_device(name, status, max(0, cost + rng.choice([-3, -1, 1, 3])))
+        elif kind == "device_status":
+            name = rng.choice(names)
+            status, cost = self.devices[name]
+            self.put_device(name, 1 - status if status in (0, 1) else 0, cost)
+        elif kind == "connection_cost" and self.connections:
+            src, dst = rng.choice(sorted(self.connections))
+            cost = self.connections[src, dst]
+            self.put_connection(src, dst, max(1, cost + rng.choice([-4, -1, 2, 5])))
+        elif kind == "add_connection":
+            free = [
+                (src, dst) for src in names for dst in names
+                if src != dst and (src, dst) not in self.connections
+                and (dst, src) not in self.connections
+            ]
+            if free:
+                self.put_connection(*rng.choice(free), rng.randint(1, 9))
+        elif kind == "delete_connection" and self.connections:
+            self.delete_connection(*rng.choice(sorted(self.connections)))
+        elif kind == "device_batch":
+            items = []
+            for name in rng.sample(names, 2):
+                status, cost = self.devices[name]
+                cost = max(0, cost + rng.choice([-2, 2]))
+                items.append({"name": name, "isSource": False, "isDest": False,
+                              "status": status, "cost": cost})
+                self.devices[name] = (status, cost)
+            self.batch("/batch/devices/", items)
+        elif kind == "connection_batch" and self.connections:
+            items = []
+            for src, dst in rng.sample(sorted(self.connections), min(2, len(self.connections))):
+                cost = max(1, self.connections[src, dst] + rng.choice([-3, 3]))
+                items.append({"src": src, "dst": dst, "cost": cost})
+                self.connections[src, dst] = cost
+            self.batch("/batch/connections/", items)
+        elif kind == "replace_device":
+            # Gone with its connections, then back without any
+            name = rng.choice(names[1:])
+            cost = self.devices[name][1]
+            self.delete_device(name)
+            self.put_device(name, 0, cost)
+
+    def in_service(self) -> list[str]:
+        return sorted(name for name, (status, _) in self.devices.items() if status == 0)
+
+    def expected(self, brute_force, src: str, dst: str):
+        vertices = [(name, cost) for name, (_, cost) in self.devices.items()]
+        edges = [(u, v, cost) for (u, v), cost in self.connections.items()]
+        disabled = {name for name, (status, _) in self.devices.items() if status != 0}
+        return brute_force(vertices, edges, src, dst, disabled)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_stored_paths_follow_random_writes(api, random_graph, brute_force, seed):
+    rng = random.Random(seed)
+    plant = Plant(api, rng, *random_graph(8, 16, seed))
+    from_store = 0
+    for _ in range(40):
+        plant.random_write()
+        names = plant.in_service()
+        for src in names[:2]:
+            destinations = [name for name in names[-3:] if name != src]
+            for K in (1, 3):
+                # The first query may be served from paths stored before the
+                # write, the second one is
+                for _ in range(2):
+                    response = api.get("/best/paths/", params={
+                        "src": src, "dst": ",".join(destinations), "num_best_path": K
+                    })
+                    assert response.status_code == 200, response.text
+                    from_store += response.headers["X-Search-Expansions"] == "0"
+                    for dst, found in response.json().items():
+                        expected = plant.expected(brute_force, src, dst)
+                        assert [item["cost"] for item in found] == [cost for cost, _ in expected][:K]
+                        for item in found:
+                            assert (item["cost"], item["path"]) in expected
+    # Targeted invalidation keeps results across writes
+    assert from_store > 0
+
+
+def test_paths_of_an_old_version_are_not_saved(api, api_app):
+    plant = Plant(api, random.Random(0), [("A", 1), ("B", 1), ("C", 1)],
+                  [("A", "B", 1), ("B", "C", 1)])
+    G, version = api_app.graph_cache.snapshot()
+    paths = {"C": [{"path": ["A", "B", "C"], "cost": 3, "dst": "C"}]}
+    # A write commits between the search and the save
+    plant.put_connection("A", "C", 9)
+    api_app.save_stored_paths("A", paths, 1, version)
+    with api_app.Session() as session:
+        assert path_store.stored_results(session, version) == []
+        assert path_store.stored_results(session, version + 1) == []
+    api_app.save_stored_paths("A", paths, 1, version + 1)
+    with api_app.Session() as session:
+        assert path_store.stored_results(session, version + 1) == [("A", "C", 1, 3, 1)]